@@ -4,26 +4,184 @@ Healthcare Portal - Flask Web Application
 A comprehensive healthcare management system with role-based access control.
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, make_response
+from flask.json.provider import JSONProvider
+from flask_caching import Cache
+from flask_compress import Compress
+from flask_session import Session
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 import os
+import atexit
+import csv
 import hashlib
-from datetime import datetime, timedelta
+import io
+import threading
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import re
 from functools import wraps
+from typing import List, Optional
+import httpx
+import orjson
+from pydantic import BaseModel, TypeAdapter, ValidationError, field_validator
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import redis
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from supabase import create_client, Client
+from audit import AuditLogWriter
+from auth import DUMMY_HASH, hash_password, verify_password, password_needs_rehash, validate_password, validate_email
 
 # Load environment variables
 load_dotenv()
 
+def _form_dict(keys):
+    """Stripped values of the given form fields in one pass; blanks become None, absent keys are left out"""
+    form = request.form
+    return {k: (v.strip() or None) for k in keys if (v := form.get(k)) is not None}
+
+def _idempotency_key():
+    """The form's idempotency_key as a canonical UUID string, or None when missing or malformed"""
+    try:
+        return str(uuid.UUID(request.form.get('idempotency_key', '')))
+    except ValueError:
+        return None
+
+def _page_args(default_size):
+    """1-based page number and page size from the query string; page size is capped at 50"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', default_size, type=int), 1), 50)
+    return page, page_size
+
+def _flatten_specialization(doctor):
+    """Replace an embedded medical_staff(specialization) with a flat 'specialization' key"""
+    staff = doctor.pop('medical_staff', None) or {}
+    if isinstance(staff, list):
+        staff = staff[0] if staff else {}
+    doctor['specialization'] = staff.get('specialization')
+
+# Templates of the busiest pages, resolved once at startup outside debug
+_HOT_TEMPLATES = (
+    'appointments/list.html', 'appointments/book.html', 'appointments/details.html',
+    'patients/list.html', 'patients/details.html', 'medical_records/list.html',
+)
+
+_USER_FIELDS = ('username', 'email', 'first_name', 'last_name', 'phone_number', 'address')
+_STAFF_FIELDS = ('specialization', 'license_number', 'department')
+_ROLE_FIELDS = {
+    'patient': ('emergency_contact', 'insurance_info', 'blood_type'),
+    'doctor': _STAFF_FIELDS,
+    'nurse': _STAFF_FIELDS,
+}
+_REGISTER_REQUIRED = ('username', 'first_name', 'last_name')
+_RECORD_FIELDS = ('patient_id', 'doctor_id', 'visit_date', 'diagnosis', 'treatment', 'prescription', 'notes', 'visit_type')
+_VITAL_FIELDS = ('patient_id', 'temperature', 'blood_pressure', 'pulse', 'respiratory_rate', 'oxygen_saturation', 'notes')
+
+class MedicalRecordIn(BaseModel):
+    """One row of a bulk medical record upload; field names match _RECORD_FIELDS"""
+    patient_id: int
+    doctor_id: Optional[int] = None
+    visit_date: datetime
+    diagnosis: Optional[str] = None
+    treatment: Optional[str] = None
+    prescription: Optional[str] = None
+    notes: Optional[str] = None
+    visit_type: Optional[str] = None
+
+    @field_validator('doctor_id', 'diagnosis', 'treatment', 'prescription', 'notes', 'visit_type', mode='before')
+    @classmethod
+    def _blank_to_none(cls, value):
+        return None if value == '' else value
+
+_RECORD_LIST = TypeAdapter(List[MedicalRecordIn])
+
+_LOGIN_REQUIRED_MSG = 'Please log in to access this page.'
+_FORBIDDEN_MSG = 'You do not have permission to access this page.'
+
+class ORJSONResponse(httpx.Response):
+    def json(self, **kwargs):
+        return orjson.loads(self.content)
+
+class PostgrestSession(httpx.Client):
+    """httpx client for PostgREST whose responses decode JSON with orjson"""
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        response.__class__ = ORJSONResponse
+        return response
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool that waits for a free connection instead of raising PoolError"""
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        self._slots.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which statements it has PREPAREd, least recently used first"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+        self.max_prepared = int(os.getenv("PG_PREPARED_MAX", 100))
+
+def _execute_prepared(cur, query, params):
+    """Run a SELECT written with $n placeholders as a named prepared statement.
+
+    PREPAREd once per connection, so repeat executions skip parse and plan; past
+    max_prepared the least recently used statement is DEALLOCATEd. Only used on
+    PreparingConnection.
+    """
+    conn = cur.connection
+    name = "q_" + hashlib.md5(query.encode()).hexdigest()[:16]
+    if name in conn.prepared:
+        conn.prepared.move_to_end(name)
+    else:
+        if len(conn.prepared) >= conn.max_prepared:
+            stale, _ = conn.prepared.popitem(last=False)
+            cur.execute(f"DEALLOCATE {stale}")
+        cur.execute(f"PREPARE {name} AS {query}")
+        conn.prepared[name] = None
+    args = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    cur.execute(f"EXECUTE {name}{args}", params)
+
+@contextmanager
+def _pooled(pool):
+    """Check out a connection for one statement batch: commit on success, roll back on error, always return it"""
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
 class DatabaseManager:
     """Wrapper to support both Supabase and Local PostgreSQL"""
     def __init__(self, use_local=False):
         self.use_local = use_local
         self.supabase = None
-        self.conn = None
+        self.pool = None
         
         if use_local:
             self.setup_local()
@@ -36,19 +194,50 @@ class DatabaseManager:
         if url and key:
             try:
                 self.supabase = create_client(url, key)
+                self.setup_http_pool()
                 print("✅ Connected to Supabase")
             except Exception as e:
                 print(f"❌ Supabase Connection Error: {e}")
 
+    def setup_http_pool(self):
+        """Replace PostgREST's default httpx session with a keep-alive HTTP/2 pool"""
+        postgrest = self.supabase.postgrest
+        default_session = postgrest.session
+        postgrest.session = PostgrestSession(
+            base_url=default_session.base_url,
+            # Compressed responses roughly halve the bytes of the larger list queries
+            headers={**default_session.headers, "Accept-Encoding": "gzip"},
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("SUPABASE_MAX_CONNECTIONS", 200)),
+                max_keepalive_connections=int(os.getenv("SUPABASE_MAX_KEEPALIVE", 50)),
+                keepalive_expiry=float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", 60))
+            ),
+            timeout=httpx.Timeout(
+                float(os.getenv("SUPABASE_TIMEOUT", 10)),
+                connect=float(os.getenv("SUPABASE_CONNECT_TIMEOUT", 3))
+            )
+        )
+        default_session.close()
+        atexit.register(postgrest.session.close)
+
     def setup_local(self):
         try:
-            self.conn = psycopg2.connect(
+            # Each query checks a connection out and back in, so request threads
+            # and run_parallel workers no longer take turns on a single socket
+            prepare = os.getenv("PG_PREPARED_STATEMENTS", "False").lower() == "true"
+            self.pool = BlockingConnectionPool(
+                int(os.getenv("PG_POOL_MIN", 5)),
+                int(os.getenv("PG_POOL_MAX", 25)),
+                connection_factory=PreparingConnection if prepare else None,
                 dbname=os.getenv("LOCAL_DB_NAME", "healthcare_portal"),
                 user=os.getenv("LOCAL_DB_USER", "postgres"),
                 password=os.getenv("LOCAL_DB_PASSWORD", "postgres"),
                 host=os.getenv("LOCAL_DB_HOST", "localhost"),
                 port=os.getenv("LOCAL_DB_PORT", "5432")
             )
+            atexit.register(self.pool.closeall)
             print("✅ Connected to Local PostgreSQL")
         except Exception as e:
             print(f"❌ Local DB Connection Error: {e}")
@@ -56,29 +245,120 @@ class DatabaseManager:
     def table(self, table_name):
         if not self.use_local and self.supabase:
             return self.supabase.table(table_name)
-        return LocalQueryBuilder(self.conn, table_name)
+        return LocalQueryBuilder(self.pool, table_name)
+
+    def rpc(self, fn_name, params=None):
+        """Call a database function (see sql/functions.sql)"""
+        if not self.use_local and self.supabase:
+            return self.supabase.rpc(fn_name, params or {})
+        return LocalRpcCall(self.pool, fn_name, params or {})
+
+    def copy_rows(self, table_name, columns, rows):
+        """Bulk-load rows with COPY ... FROM STDIN, bypassing PostgREST; returns the number of rows.
+
+        Rows are copied into an unlogged temporary stage and merged with a single
+        INSERT ... SELECT, so the target's indexes are maintained in one set-oriented pass.
+        Uses the local pool, or a direct connection to DATABASE_URL in Supabase mode.
+        Returns None when neither is available so the caller can fall back to insert().
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            # None is written unquoted, which COPY's CSV format reads as NULL
+            writer.writerow([row.get(c) for c in columns])
+        buffer.seek(0)
+        column_list = ', '.join(columns)
+        stage = f"{table_name}_stage"
+
+        def load(conn):
+            with conn.cursor() as cur:
+                # Temporary tables skip WAL and are private to this session; dropped on commit
+                cur.execute(f"CREATE TEMP TABLE {stage} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+                cur.copy_expert(f"COPY {stage} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+                cur.execute(f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {stage}")
+                return cur.rowcount
+
+        if self.pool:
+            with _pooled(self.pool) as conn:
+                return load(conn)
+        dsn = os.getenv("DATABASE_URL")
+        if not dsn:
+            return None
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn:
+                return load(conn)
+        finally:
+            conn.close()
+
+# Embedded selects: "users!doctor_id(first_name)", "doctor:users!doctor_id(...)", "medical_staff(...)"
+_EMBED_RE = re.compile(r'^(?:(\w+):)?(\w+)(?:!(\w+))?\((.*)\)$')
+# Embeds without a !fk hint point back at the parent: (parent table, embedded table) -> column holding the parent id
+_REVERSE_EMBED_KEYS = {
+    ('users', 'medical_staff'): 'staff_id',
+    ('users', 'patients'): 'patient_id',
+}
+
+def _split_select(columns):
+    """Split a PostgREST select string on its top-level commas"""
+    parts, depth, current = [], 0, ''
+    for ch in columns:
+        if ch == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += (ch == '(') - (ch == ')')
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+class Result:
+    """What the local builders return in place of supabase-py's APIResponse (.data, .count)"""
+    __slots__ = ('data', 'count')
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
 
 class LocalQueryBuilder:
     """Minimal Query Builder to mimic Supabase syntax for local Postgres"""
-    def __init__(self, conn, table_name):
-        self.conn = conn
+    def __init__(self, pool, table_name):
+        self.pool = pool
         self.table_name = table_name
         self.filters = []
         self.order_by = ""
         self.limit_val = None
-        self.columns = "*"
+        self.offset_val = None
+        self.columns = "t.*"
         self.joins = []
 
     def select(self, columns="*", count=None):
-        # Handle basic Supabase join syntax: "*, users!doctor_id(first_name, last_name)"
-        if "!" in columns:
-            # Very basic parsing for common healthcare portal joins
-            # This is a hack to make the local DB work with existing templates
-            self.columns = "*" 
-            # In a real app, we'd parse this properly. For now, we'll just return everything
-            # and the templates will need to be slightly more robust or we handle it in execute()
-        else:
-            self.columns = columns
+        # Embedded resources become LEFT JOINs; their columns come back prefixed "__alias__"
+        # and are folded into nested dicts in execute(), like PostgREST does
+        select_list = []
+        for part in _split_select(columns):
+            embed = _EMBED_RE.match(part)
+            if not embed:
+                select_list.append("t.*" if part == "*" else f"t.{part}")
+                continue
+            alias, table, fk, sub_columns = embed.groups()
+            alias = alias or table
+            join = f"j{len(self.joins)}"
+            if fk:
+                condition = f"{join}.id = t.{fk}"
+            elif (self.table_name, table) in _REVERSE_EMBED_KEYS:
+                condition = f"{join}.{_REVERSE_EMBED_KEYS[(self.table_name, table)]} = t.id"
+            else:
+                raise ValueError(f"Unsupported embed {part!r} on {self.table_name}: add a !fk hint or a _REVERSE_EMBED_KEYS entry")
+            sub_list = _split_select(sub_columns)
+            # Only flat, named columns can be aliased into "__alias__column"
+            if any(column == "*" or "(" in column for column in sub_list):
+                raise ValueError(f"Unsupported embed {part!r} on {self.table_name}: list the embedded columns by name")
+            self.joins.append((alias, f"LEFT JOIN {table} {join} ON {condition}"))
+            for column in sub_list:
+                select_list.append(f'{join}.{column} AS "__{alias}__{column}"')
+        self.columns = ", ".join(select_list)
         self.count_type = count
         return self
 
@@ -86,114 +366,159 @@ class LocalQueryBuilder:
         self.filters.append((column, "=", value))
         return self
 
+    def gt(self, column, value):
+        self.filters.append((column, ">", value))
+        return self
+
+    def in_(self, column, values):
+        # psycopg2 adapts a list to an ARRAY literal
+        self.filters.append((column, "= ANY", list(values)))
+        return self
+
     def gte(self, column, value):
         self.filters.append((column, ">=", value))
         return self
 
+    def ilike(self, column, pattern):
+        self.filters.append((column, "ILIKE", pattern))
+        return self
+
     def lte(self, column, value):
         self.filters.append((column, "<=", value))
         return self
 
     def order(self, column, desc=False):
         direction = "DESC" if desc else "ASC"
-        self.order_by = f"ORDER BY {column} {direction}"
+        self.order_by = f"ORDER BY t.{column} {direction}"
         return self
 
     def limit(self, value):
         self.limit_val = value
         return self
 
-    def execute(self):
-        if not self.conn:
-            return type('Result', (), {'data': [], 'count': 0})
+    def range(self, start, end):
+        # Inclusive bounds, like PostgREST's Range header
+        self.offset_val = start
+        self.limit_val = end - start + 1
+        return self
+
+    def _where(self, mark):
+        """WHERE clause over the filters; mark(n) renders the n-th parameter ("%s" or "$n")"""
+        if not self.filters:
+            return ""
+        clauses = []
+        for n, (col, op, _) in enumerate(self.filters, 1):
+            clauses.append(f"t.{col} {op}({mark(n)})" if op == "= ANY" else f"t.{col} {op} {mark(n)}")
+        return " WHERE " + " AND ".join(clauses)
+
+    def _select_sql(self, mark):
+        """The SELECT and its parameters; LIMIT/OFFSET are parameters too, so every page shares one statement"""
+        columns = self.columns
+        if getattr(self, 'count_type', None) == 'exact':
+            # The total rides along on every row, so the count needs no second statement
+            columns += ", count(*) OVER () AS __total_count"
+        query = f"SELECT {columns} FROM {self.table_name} t"
+        for _, join in self.joins:
+            query += f" {join}"
+        query += self._where(mark)
+        params = [val for _, _, val in self.filters]
 
-        query = f"SELECT {self.columns} FROM {self.table_name}"
-        params = []
-        
-        if self.filters:
-            where_clauses = []
-            for col, op, val in self.filters:
-                where_clauses.append(f"{col} {op} %s")
-                params.append(val)
-            query += " WHERE " + " AND ".join(where_clauses)
-        
         if self.order_by:
             query += f" {self.order_by}"
         if self.limit_val:
-            query += f" LIMIT {self.limit_val}"
-            
-        try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(query, params)
-                data = cur.fetchall()
-                data_list = [dict(row) for row in data]
-                
-                # Convert datetime objects to strings for compatibility with Supabase API
-                for item in data_list:
-                    for key, value in item.items():
-                        if isinstance(value, datetime):
-                            item[key] = value.isoformat()
+            params.append(int(self.limit_val))
+            query += f" LIMIT {mark(len(params))}"
+        if self.offset_val:
+            params.append(int(self.offset_val))
+            query += f" OFFSET {mark(len(params))}"
+        return query, params
 
-                # Mock Supabase-style nested objects for common joins if they exist as IDs
-                for item in data_list:
-                    # Mock 'users' join for doctor_id
-                    if 'doctor_id' in item and item['doctor_id']:
-                        cur.execute("SELECT first_name, last_name, id FROM users WHERE id = %s", (item['doctor_id'],))
-                        user_data = cur.fetchone()
-                        if user_data:
-                            item['users'] = dict(user_data)
-                            # Handle different alias expectations
-                            item['doctor'] = dict(user_data)
-                    
-                    # Mock 'users' join for patient_id
-                    if 'patient_id' in item and item['patient_id']:
-                        cur.execute("SELECT first_name, last_name, id FROM users WHERE id = %s", (item['patient_id'],))
-                        user_data = cur.fetchone()
-                        if user_data:
-                            item['patient'] = dict(user_data)
-                            if 'users' not in item:
-                                item['users'] = dict(user_data)
+    def execute(self):
+        if not self.pool:
+            return Result([], 0)
 
-                count = len(data_list)
-                if hasattr(self, 'count_type') and self.count_type == 'exact':
-                    count_query = f"SELECT COUNT(*) FROM {self.table_name}"
-                    if self.filters:
-                        count_query += " WHERE " + " AND ".join([f"{col} {op} %s" for col, op, val in self.filters])
-                        cur.execute(count_query, [val for col, op, val in self.filters])
+        try:
+            with _pooled(self.pool) as conn:
+                if self.limit_val:
+                    cur = conn.cursor()
+                else:
+                    # Unbounded selects stream from a server-side cursor, 1000 rows per fetch
+                    cur = conn.cursor(name=f"stream_{self.table_name}")
+                    cur.itersize = 1000
+                with cur:
+                    # DECLARE cannot wrap EXECUTE, so streaming cursors stay unprepared
+                    if self.limit_val and isinstance(conn, PreparingConnection):
+                        _execute_prepared(cur, *self._select_sql(lambda n: f"${n}"))
                     else:
-                        cur.execute(count_query)
-                    count = cur.fetchone()['count']
+                        cur.execute(*self._select_sql(lambda n: "%s"))
+                    data_list = self._rows(cur)
+
+                count = len(data_list)
+                if getattr(self, 'count_type', None) == 'exact':
+                    totals = [item.pop('__total_count') for item in data_list]
+                    if totals:
+                        count = totals[0]
+                    elif self.offset_val:
+                        # Paged past the end: no row carried the total
+                        count_query = f"SELECT COUNT(*) FROM {self.table_name} t" + self._where(lambda n: "%s")
+                        with conn.cursor() as count_cur:
+                            count_cur.execute(count_query, [val for col, op, val in self.filters])
+                            count = count_cur.fetchone()[0]
 
-                return type('Result', (), {'data': data_list, 'count': count})
+                return Result(data_list, count)
         except Exception as e:
             print(f"SQL Error in {self.table_name}: {e}")
-            return type('Result', (), {'data': [], 'count': 0})
+            return Result([], 0)
+
+    def _rows(self, cur):
+        """Build Supabase-shaped dicts in a single pass: datetimes as ISO strings,
+        "__alias__column" keys folded into nested objects (None when the LEFT JOIN found nothing)"""
+        data_list = []
+        layout = None
+        for row in cur:
+            if layout is None:
+                # Named cursors only describe their columns once the first rows arrive
+                layout = []
+                for column in cur.description:
+                    alias = next((a for a, _ in self.joins if column.name.startswith(f"__{a}__")), None)
+                    layout.append((alias, column.name[len(alias) + 4:] if alias else column.name))
+            item = {}
+            nested = {alias: {} for alias, _ in self.joins}
+            for (alias, key), value in zip(layout, row):
+                if isinstance(value, datetime):
+                    value = value.isoformat()
+                if alias:
+                    nested[alias][key] = value
+                else:
+                    item[key] = value
+            for alias, values in nested.items():
+                item[alias] = values if any(v is not None for v in values.values()) else None
+            data_list.append(item)
+        return data_list
 
     def insert(self, data):
-        if not self.conn: return type('Result', (), {'data': []})
         if not isinstance(data, list): data = [data]
+        if not self.pool or not data: return Result([])
         
-        results = []
         try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-                for item in data:
-                    columns = item.keys()
-                    placeholders = ["%s"] * len(columns)
-                    query = f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES ({', '.join(placeholders)}) RETURNING *"
-                    cur.execute(query, list(item.values()))
-                    results.append(dict(cur.fetchone()))
-            self.conn.commit()
-            return type('Result', (), {'data': results})
+            with _pooled(self.pool) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # One multi-row VALUES statement per 1000 rows; every row must carry the same keys
+                columns = list(data[0].keys())
+                query = f"INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES %s RETURNING *"
+                rows = execute_values(cur, query, [tuple(item[c] for c in columns) for item in data], page_size=1000, fetch=True)
+            return Result([dict(row) for row in rows])
+        except psycopg2.IntegrityError:
+            # Surface constraint violations like supabase-py's APIError does
+            raise
         except Exception as e:
-            self.conn.rollback()
             print(f"Insert Error in {self.table_name}: {e}")
-            return type('Result', (), {'data': []})
+            return Result([])
 
     def update(self, data):
-        if not self.conn: return type('Result', (), {'data': []})
+        if not self.pool: return Result([])
         results = []
         try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            with _pooled(self.pool) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
                 set_clauses = [f"{k} = %s" for k in data.keys()]
                 params = list(data.values())
                 query = f"UPDATE {self.table_name} SET {', '.join(set_clauses)}"
@@ -206,92 +531,386 @@ class LocalQueryBuilder:
                 query += " RETURNING *"
                 cur.execute(query, params)
                 results = [dict(row) for row in cur.fetchall()]
-            self.conn.commit()
-            return type('Result', (), {'data': results})
+            return Result(results)
         except Exception as e:
-            self.conn.rollback()
             print(f"Update Error in {self.table_name}: {e}")
-            return type('Result', (), {'data': []})
+            return Result([])
+
+class LocalRpcCall:
+    """Mimics supabase.rpc() for local Postgres by calling the SQL function directly"""
+    def __init__(self, pool, fn_name, params):
+        self.pool = pool
+        self.fn_name = fn_name
+        self.params = params
+
+    def execute(self):
+        if not self.pool:
+            return Result(None)
+
+        args = ", ".join(f"{name} => %s" for name in self.params)
+        query = f"SELECT * FROM {self.fn_name}({args})"
+        values = [Json(v) if isinstance(v, (dict, list)) else v for v in self.params.values()]
+        try:
+            with _pooled(self.pool) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, values)
+                rows = [dict(row) for row in cur.fetchall()]
+                for item in rows:
+                    for key, value in item.items():
+                        if isinstance(value, datetime):
+                            item[key] = value.isoformat()
+                # PostgREST unwraps functions returning a single scalar (json, int, ...)
+                if len(cur.description) == 1 and cur.description[0].name == self.fn_name:
+                    data = rows[0][self.fn_name] if rows else None
+                else:
+                    data = rows
+            return Result(data)
+        except psycopg2.IntegrityError:
+            raise
+        except Exception as e:
+            print(f"RPC Error in {self.fn_name}: {e}")
+            return Result(None)
+
+class ORJSONProvider(JSONProvider):
+    """jsonify() backed by orjson; unknown types (Decimal, date) fall back to str"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 class HealthcareApp:
     def __init__(self):
         self.app = Flask(__name__)
         self.setup_config()
+        self.setup_templates()
+        self.cache = Cache(self.app)
+        Compress(self.app)
+        self.setup_sessions()
         self.setup_database()
+        self.setup_request_hooks()
+        self.setup_error_handlers()
         self.setup_routes()
     
     def setup_config(self):
         """Configure Flask app"""
+        self.app.json = ORJSONProvider(self.app)
         self.app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
         self.app.config['SESSION_TIMEOUT'] = int(os.getenv('SESSION_TIMEOUT', 3600))
         self.app.config['PASSWORD_MIN_LENGTH'] = int(os.getenv('PASSWORD_MIN_LENGTH', 8))
         self.app.config['MAX_LOGIN_ATTEMPTS'] = int(os.getenv('MAX_LOGIN_ATTEMPTS', 5))
+        self.app.config['AUDIT_BUFFER_SIZE'] = int(os.getenv('AUDIT_BUFFER_SIZE', 500))
+        self.app.config['AUDIT_FLUSH_INTERVAL'] = float(os.getenv('AUDIT_FLUSH_INTERVAL', 5))
+        self.app.config['AUDIT_QUEUE_MAX'] = int(os.getenv('AUDIT_QUEUE_MAX', 10000))
+        self.app.config['ITEMS_PER_PAGE'] = int(os.getenv('ITEMS_PER_PAGE', 20))
+        self.app.config['QUERY_WORKERS'] = int(os.getenv('QUERY_WORKERS', 8))
+        self.app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'SimpleCache')
+        self.app.config['CACHE_REDIS_URL'] = os.getenv('REDIS_URL')
+        self.app.config['CACHE_DEFAULT_TIMEOUT'] = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 300))
+        self.app.config['ADMIN_STATS_CACHE_TTL'] = int(os.getenv('ADMIN_STATS_CACHE_TTL', 30))
+        self.app.config['DASHBOARD_CACHE_TTL'] = int(os.getenv('DASHBOARD_CACHE_TTL', 30))
+        self.app.config['USER_RECHECK_INTERVAL'] = int(os.getenv('USER_RECHECK_INTERVAL', 300))
+        self.app.config['DIRECTORY_CACHE_TTL'] = int(os.getenv('DIRECTORY_CACHE_TTL', 60))
+        self.app.config['PROFILE_CACHE_TTL'] = int(os.getenv('PROFILE_CACHE_TTL', 300))
         self.app.permanent_session_lifetime = timedelta(seconds=self.app.config['SESSION_TIMEOUT'])
+        # Responses are gzip/brotli-compressed when the client accepts it
+        self.app.config['COMPRESS_MIMETYPES'] = ['text/html', 'application/json', 'text/css', 'application/javascript']
+        self.app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 5))
+        self.app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.getenv('STATIC_MAX_AGE', 3600))
     
+    def setup_sessions(self):
+        """Server-side sessions in Redis when SESSION_TYPE=redis; otherwise Flask's signed cookie"""
+        if os.getenv('SESSION_TYPE', '').lower() != 'redis':
+            return
+        # The cookie then only carries a session id; the payload stays in Redis
+        self.app.config['SESSION_TYPE'] = 'redis'
+        self.app.config['SESSION_REDIS'] = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        self.app.config['SESSION_KEY_PREFIX'] = 'session:'
+        Session(self.app)
+
+    def setup_templates(self):
+        """Compile templates once: no mtime checks outside debug, bytecode shared across workers"""
+        self.app.config['TEMPLATES_AUTO_RELOAD'] = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+        cache_dir = os.getenv('JINJA_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'healthcare-portal-jinja')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        # render_template() accepts Template objects and still applies context processors
+        self._templates = {} if self.app.config['TEMPLATES_AUTO_RELOAD'] else {
+            name: self.app.jinja_env.get_template(name) for name in _HOT_TEMPLATES
+        }
+
+    def template(self, name):
+        """Pre-resolved Template for a hot page, or the name itself when templates auto-reload"""
+        return self._templates.get(name, name)
+
     def setup_database(self):
         """Initialize Database connection"""
         use_local = os.getenv("USE_LOCAL_DB", "False").lower() == "true"
         self.db = DatabaseManager(use_local=use_local)
         # Compatibility layer
         self.supabase = self.db
+        self.audit_log = AuditLogWriter(
+            self.db,
+            buffer_size=self.app.config['AUDIT_BUFFER_SIZE'],
+            flush_interval=self.app.config['AUDIT_FLUSH_INTERVAL'],
+            max_queue=self.app.config['AUDIT_QUEUE_MAX']
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.app.config['QUERY_WORKERS'], thread_name_prefix="db-query")
     
-    def hash_password(self, password: str) -> str:
-        return hashlib.sha256(password.encode()).hexdigest()
-    
-    def validate_password(self, password: str) -> tuple[bool, str]:
-        min_length = self.app.config['PASSWORD_MIN_LENGTH']
-        if len(password) < min_length:
-            return False, f"Password must be at least {min_length} characters long"
-        if not re.search(r"[A-Za-z]", password):
-            return False, "Password must contain at least one letter"
-        if not re.search(r"[0-9]", password):
-            return False, "Password must contain at least one number"
-        return True, ""
-    
-    def validate_email(self, email: str) -> bool:
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
-    
+    def setup_request_hooks(self):
+        """Per-request state shared by decorators and route handlers"""
+        @self.app.before_request
+        def load_current_user():
+            g.user_id = session.get('user_id')
+            g.role = session.get('role')
+            g.now = datetime.now()
+            g.today_iso = g.now.date().isoformat()
+
+    def setup_error_handlers(self):
+        """Error pages; the anonymous version of each is rendered once and then reused"""
+        rendered = {}
+
+        def error_page(template, status):
+            # Scanners hitting random URLs are anonymous; signed-in users still get their own nav
+            if g.get('user_id') is None and not session.get('_flashes'):
+                if template not in rendered:
+                    rendered[template] = render_template(template)
+                return rendered[template], status
+            return render_template(template), status
+
+        @self.app.errorhandler(403)
+        def forbidden(e):
+            return error_page('errors/403.html', 403)
+
+        @self.app.errorhandler(404)
+        def not_found(e):
+            return error_page('errors/404.html', 404)
+
+        @self.app.errorhandler(500)
+        def server_error(e):
+            return error_page('errors/500.html', 500)
+
+    def _staff_query(self):
+        return self.db.table("medical_staff").select("specialization, license_number, hire_date, department, status").eq("staff_id", g.user_id)
+
+    def _current_staff(self, prefetched=None):
+        """medical_staff row of the logged-in user, fetched at most once per request.
+
+        prefetched takes the rows of a _staff_query() already run (e.g. via run_parallel).
+        """
+        if 'staff' not in g:
+            rows = prefetched if prefetched is not None else self._staff_query().execute().data
+            g.staff = rows[0] if rows else {}
+        return g.staff
+
+    def run_parallel(self, *queries):
+        """Execute independent queries concurrently over the HTTP or connection pool; returns their data in order"""
+        futures = [self.executor.submit(query.execute) for query in queries]
+        return [future.result().data for future in futures]
+
+    def get_admin_stats(self):
+        """Admin dashboard figures, cached for ADMIN_STATS_CACHE_TTL seconds"""
+        stats = self.cache.get('admin_stats')
+        if stats is None:
+            stats = self.db.rpc("get_admin_dashboard_stats").execute().data
+            if stats:
+                self.cache.set('admin_stats', stats, timeout=self.app.config['ADMIN_STATS_CACHE_TTL'])
+        return dict(stats or {})
+
+    def get_admin_counts(self):
+        """Headline counts for the stats API, cached for ADMIN_STATS_CACHE_TTL seconds"""
+        counts = self.cache.get('admin_counts')
+        if counts is None:
+            counts = self.db.rpc("get_admin_counts").execute().data
+            if counts:
+                self.cache.set('admin_counts', counts, timeout=self.app.config['ADMIN_STATS_CACHE_TTL'])
+        return counts or {}
+
+    def invalidate_activity(self, doctor_id=None):
+        """Drop the cached dashboards and stats an appointment, record or new user makes stale"""
+        keys = ['admin_stats', 'admin_counts', 'nurse_dashboard']
+        if doctor_id:
+            keys.append(f'doctor_dashboard:{doctor_id}')
+        self.cache.delete_many(*keys)
+
+    def get_profile(self, user_id, role):
+        """users row plus the patients/medical_staff row for the profile page, cached per user"""
+        key = f'profile:{user_id}'
+        profile = self.cache.get(key)
+        if profile is None:
+            queries = [self.db.table("users").select("username, first_name, last_name, role, email, phone_number, address, created_at").eq("id", user_id)]
+            if role == 'patient':
+                queries.append(self.db.table("patients").select("emergency_contact, insurance_info, blood_type").eq("patient_id", user_id))
+            elif role in ('doctor', 'nurse'):
+                queries.append(self.db.table("medical_staff").select("specialization, license_number, hire_date, department").eq("staff_id", user_id))
+            user_rows, *role_rows = self.run_parallel(*queries)
+            if not user_rows:
+                return None
+            role_data = role_rows[0][0] if role_rows and role_rows[0] else {}
+            profile = {'user_data': user_rows[0], 'role_data': role_data}
+            self.cache.set(key, profile, timeout=self.app.config['PROFILE_CACHE_TTL'])
+        return profile
+
+    def refresh_cached_profile(self, user_id, changes):
+        """Write profile edits through to the cache so the page re-renders without re-reading them"""
+        key = f'profile:{user_id}'
+        profile = self.cache.get(key)
+        if profile is None:
+            return
+        profile['user_data'].update(changes)
+        self.cache.set(key, profile, timeout=self.app.config['PROFILE_CACHE_TTL'])
+
+    def data_version(self, query, *embedded):
+        """Row count and newest updated_at of a filtered query: a cheap marker that changes on any insert, edit or delete.
+
+        embedded are queries on the tables the page embeds (e.g. users for patient and
+        doctor names); their newest updated_at joins the marker, so editing an embedded
+        row changes it too. All queries run concurrently.
+        """
+        futures = [self.executor.submit(q.order("updated_at", desc=True).limit(1).execute) for q in (query, *embedded)]
+        results = [future.result() for future in futures]
+        return (results[0].count, *(result.data[0]['updated_at'] if result.data else None for result in results))
+
+    def conditional_page(self, version, render):
+        """Render a GET page with an ETag, or answer 304 when the browser already has this version.
+
+        version is called only when a tag is needed: the landing page of a POST/redirect
+        carries a flash that has to be rendered anyway, so it skips the version query.
+        """
+        if session.get('_flashes'):
+            response = make_response(render())
+        else:
+            # Pages show the viewer's name in the nav and differ per query string, so both go into the tag
+            raw = f"{g.user_id}:{g.role}:{session.get('first_name')}:{session.get('last_name')}:{request.full_path}:{version()}"
+            etag = hashlib.md5(raw.encode()).hexdigest()
+            # Flask-Compress appends ":gzip"/":br" to the tags of compressed responses
+            current = {tag.split(':', 1)[0] for tag in request.if_none_match.as_set()}
+            if etag in current:
+                response = self.app.response_class(status=304)
+            else:
+                response = make_response(render())
+            response.set_etag(etag)
+        # Medical data: only the user's own browser may keep it, and it must revalidate every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def get_doctors(self):
+        """All doctors with their specialization, cached for DIRECTORY_CACHE_TTL seconds"""
+        doctors = self.cache.get('doctors_list')
+        if doctors is None:
+            # Specialization comes embedded from medical_staff in the same request
+            doctors = self.db.table("users").select("id, first_name, last_name, medical_staff(specialization)").eq("role", "doctor").order("last_name").execute().data
+            for doctor in doctors:
+                _flatten_specialization(doctor)
+            if doctors:
+                self.cache.set('doctors_list', doctors, timeout=self.app.config['DIRECTORY_CACHE_TTL'])
+        return doctors
+
+    def doctor_ids(self):
+        """Ids of every doctor, from the cached doctor list"""
+        return {doctor['id'] for doctor in self.get_doctors()}
+
+    def get_doctor_options(self):
+        """The doctor <option> list rendered once and cached next to doctors_list"""
+        options = self.cache.get('doctor_options')
+        if options is None:
+            options = Markup('').join(
+                Markup('<option value="{}" data-specialization="{}">Dr. {} {}</option>\n').format(
+                    d['id'], d.get('specialization') or 'General Practice', d['first_name'], d['last_name'])
+                for d in self.get_doctors()
+            )
+            if options:
+                self.cache.set('doctor_options', str(options), timeout=self.app.config['DIRECTORY_CACHE_TTL'])
+        return Markup(options)
+
+    def audit_entry(self, user_id: int, action: str, table_name: str = None, record_id: int = None):
+        return {
+            "user_id": user_id,
+            "action": action,
+            "table_name": table_name,
+            "record_id": record_id,
+            "ip_address": request.remote_addr if request else '127.0.0.1',
+            "user_agent": (request.headers.get('User-Agent', '')[:500]) if request else 'CLI',
+            # Stamped here because the row is written later by the background writer
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+
     def log_action(self, user_id: int, action: str, table_name: str = None, record_id: int = None):
         try:
-            log_data = {
-                "user_id": user_id,
-                "action": action,
-                "table_name": table_name,
-                "record_id": record_id,
-                "ip_address": request.remote_addr if request else '127.0.0.1',
-                "user_agent": (request.headers.get('User-Agent', '')[:500]) if request else 'CLI'
-            }
-            self.db.table("audit_logs").insert(log_data).execute()
+            self.audit_log.put(self.audit_entry(user_id, action, table_name, record_id))
         except Exception as e:
             print(f"Warning: Could not log action: {e}")
     
+    def medical_record_rows(self, body):
+        """Parse and validate a JSON list (or single object) of medical records for a bulk write.
+
+        Returns (rows, None), or (None, message) when the payload is unusable.
+        """
+        try:
+            records = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return None, 'Request body is not valid JSON.'
+        if isinstance(records, dict):
+            records = [records]
+        if not isinstance(records, list) or not records:
+            return None, 'Expected a JSON list of records.'
+        try:
+            rows = _RECORD_LIST.dump_python(_RECORD_LIST.validate_python(records), mode='json')
+        except ValidationError as e:
+            error = e.errors()[0]
+            return None, f"Record {error['loc'][0]}: {'.'.join(map(str, error['loc'][1:]))} {error['msg']}"
+        for row in rows:
+            # Doctors can only file records under their own name, as on the form
+            if g.role == 'doctor':
+                row['doctor_id'] = g.user_id
+            row['visit_type'] = row['visit_type'] or 'general'
+        if not all(row['doctor_id'] for row in rows):
+            return None, 'Every record needs a doctor_id.'
+        # Checked against the cached doctor list so a bad id costs no database round-trip
+        unknown = {row['doctor_id'] for row in rows} - self.doctor_ids()
+        if unknown:
+            return None, f"Unknown doctor_id: {', '.join(map(str, sorted(unknown)))}"
+        return rows, None
+
+    def duplicate_key_column(self, error):
+        """Column behind a unique-constraint violation (SQLSTATE 23505), or None for other errors"""
+        code = getattr(error, 'pgcode', None) or getattr(error, 'code', None)
+        if code != '23505':
+            return None
+        # Both backends report "Key (column)=(value) already exists."
+        match = re.search(r'Key \((\w+)\)=', str(getattr(error, 'details', None) or error))
+        return match.group(1) if match else ''
+    
     def login_required(self, f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
-                flash('Please log in to access this page.', 'warning')
+            if g.user_id is None:
+                flash(_LOGIN_REQUIRED_MSG, 'warning')
                 return redirect(url_for('login'))
             
-            # Verify user still exists in DB (to prevent crashes after DB reset)
-            user_check = self.db.table("users").select("id").eq("id", session['user_id']).execute()
-            if not user_check.data:
-                session.clear()
-                flash('Session expired or user no longer exists. Please log in again.', 'warning')
-                return redirect(url_for('login'))
+            # Verify user still exists in DB (to prevent crashes after DB reset),
+            # at most once per USER_RECHECK_INTERVAL; the timestamp rides in the signed session
+            now = time.time()
+            if now - session.get('user_verified_at', 0) >= self.app.config['USER_RECHECK_INTERVAL']:
+                user_check = self.db.table("users").select("id").eq("id", g.user_id).execute()
+                if not user_check.data:
+                    session.clear()
+                    flash('Session expired or user no longer exists. Please log in again.', 'warning')
+                    return redirect(url_for('login'))
+                session['user_verified_at'] = now
                 
             return f(*args, **kwargs)
         return decorated_function
     
     def role_required(self, *roles):
+        roles = frozenset(roles)
         def decorator(f):
             @wraps(f)
             def decorated_function(*args, **kwargs):
-                if 'user_id' not in session:
-                    flash('Please log in to access this page.', 'warning')
+                if g.user_id is None:
+                    flash(_LOGIN_REQUIRED_MSG, 'warning')
                     return redirect(url_for('login'))
-                if session.get('role') not in roles:
-                    flash('You do not have permission to access this page.', 'danger')
+                if g.role not in roles:
+                    flash(_FORBIDDEN_MSG, 'danger')
                     return redirect(url_for('dashboard'))
                 return f(*args, **kwargs)
             return decorated_function
@@ -311,21 +930,25 @@ class HealthcareApp:
                     flash('Please enter both username and password.', 'danger')
                     return render_template('login.html')
                 try:
-                    hashed_password = self.hash_password(password)
-                    result = self.db.table("users").select("*").eq("username", username).eq("password", hashed_password).execute()
-                    if result.data:
-                        user = result.data[0]
+                    result = self.db.table("users").select("id, username, password, role, first_name, last_name").eq("username", username).execute()
+                    user = result.data[0] if result.data else None
+                    if user is None:
+                        verify_password(DUMMY_HASH, password)
+                    elif verify_password(user['password'], password):
+                        if password_needs_rehash(user['password']):
+                            self.db.table("users").update({"password": hash_password(password)}).eq("id", user['id']).execute()
                         session.permanent = True
                         session['user_id'] = user['id']
                         session['username'] = user['username']
                         session['role'] = user['role']
                         session['first_name'] = user['first_name']
                         session['last_name'] = user['last_name']
+                        # Just read from the database, so the existence check can wait a full interval
+                        session['user_verified_at'] = time.time()
                         self.log_action(user['id'], "USER_LOGIN", "users", user['id'])
                         flash(f'Welcome, {user["first_name"]}!', 'success')
                         return redirect(url_for('dashboard'))
-                    else:
-                        flash('Invalid username or password.', 'danger')
+                    flash('Invalid username or password.', 'danger')
                 except Exception as e:
                     flash(f'Login error: {str(e)}', 'danger')
             return render_template('login.html')
@@ -333,23 +956,18 @@ class HealthcareApp:
         @self.app.route('/register', methods=['GET', 'POST'])
         def register():
             if request.method == 'POST':
-                username = request.form.get('username', '').strip()
                 password = request.form.get('password', '')
                 confirm_password = request.form.get('confirm_password', '')
                 role = request.form.get('role', '')
-                email = request.form.get('email', '').strip()
-                first_name = request.form.get('first_name', '').strip()
-                last_name = request.form.get('last_name', '').strip()
-                phone_number = request.form.get('phone_number', '').strip() or None
-                address = request.form.get('address', '').strip() or None
+                data = _form_dict(_USER_FIELDS + _ROLE_FIELDS.get(role, ()))
                 
-                if not all([username, password, role, first_name, last_name]):
+                if not (password and role and all(data.get(k) for k in _REGISTER_REQUIRED)):
                     flash('Please fill in all required fields.', 'danger')
                     return render_template('register.html')
                 if password != confirm_password:
                     flash('Passwords do not match.', 'danger')
                     return render_template('register.html')
-                is_valid, error_msg = self.validate_password(password)
+                is_valid, error_msg = validate_password(password, self.app.config['PASSWORD_MIN_LENGTH'])
                 if not is_valid:
                     flash(error_msg, 'danger')
                     return render_template('register.html')
@@ -358,37 +976,23 @@ class HealthcareApp:
                     return render_template('register.html')
                 
                 try:
-                    existing_user = self.db.table("users").select("id").eq("username", username).execute()
-                    if existing_user.data:
-                        flash('Username already exists.', 'danger')
+                    payload = dict(data, password=hash_password(password), role=role,
+                                   audit=self.audit_entry(None, "USER_REGISTERED", "users"))
+                    # One transaction for users + patients/medical_staff + the audit row; UNIQUE
+                    # constraints on username/email/license_number do the existence checks
+                    try:
+                        user_id = self.db.rpc("register_user", {"payload": payload}).execute().data
+                    except Exception as e:
+                        column = self.duplicate_key_column(e)
+                        if column is None:
+                            raise
+                        messages = {'email': 'Email already registered.', 'license_number': 'License number already registered.'}
+                        flash(messages.get(column, 'Username already exists.'), 'danger')
                         return render_template('register.html')
                     
-                    user_data = {
-                        "username": username, "password": self.hash_password(password),
-                        "role": role, "email": email, "first_name": first_name,
-                        "last_name": last_name, "phone_number": phone_number, "address": address
-                    }
-                    result = self.db.table("users").insert(user_data).execute()
-                    
-                    if result.data:
-                        user_id = result.data[0]["id"]
-                        if role == 'patient':
-                            self.db.table("patients").insert({
-                                "patient_id": user_id,
-                                "emergency_contact": request.form.get('emergency_contact'),
-                                "insurance_info": request.form.get('insurance_info'),
-                                "blood_type": request.form.get('blood_type')
-                            }).execute()
-                        elif role in ['doctor', 'nurse']:
-                            self.db.table("medical_staff").insert({
-                                "staff_id": user_id,
-                                "specialization": request.form.get('specialization'),
-                                "license_number": request.form.get('license_number'),
-                                "hire_date": datetime.now().date().isoformat(),
-                                "department": request.form.get('department'),
-                                "status": "active"
-                            }).execute()
-                        self.log_action(user_id, "USER_REGISTERED", "users", user_id)
+                    if user_id:
+                        self.invalidate_activity()
+                        self.cache.delete_many('doctors_list', 'doctor_options')
                         flash('Registration successful!', 'success')
                         return redirect(url_for('login'))
                 except Exception as e:
@@ -397,8 +1001,8 @@ class HealthcareApp:
         
         @self.app.route('/logout')
         def logout():
-            if 'user_id' in session:
-                self.log_action(session['user_id'], "USER_LOGOUT", "users", session['user_id'])
+            if g.user_id is not None:
+                self.log_action(g.user_id, "USER_LOGOUT", "users", g.user_id)
             session.clear()
             flash('Logged out successfully.', 'info')
             return redirect(url_for('index'))
@@ -406,7 +1010,7 @@ class HealthcareApp:
         @self.app.route('/dashboard')
         @self.login_required
         def dashboard():
-            role = session.get('role')
+            role = g.role
             if role == 'patient': return redirect(url_for('patient_dashboard'))
             if role == 'nurse': return redirect(url_for('nurse_dashboard'))
             if role == 'doctor': return redirect(url_for('doctor_dashboard'))
@@ -417,11 +1021,8 @@ class HealthcareApp:
         @self.role_required('patient')
         def patient_dashboard():
             try:
-                user_id = session['user_id']
-                patient_info = self.db.table("patients").select("*").eq("patient_id", user_id).execute().data
-                records = self.db.table("medical_records").select("*, users!doctor_id(*)").eq("patient_id", user_id).order("visit_date", desc=True).limit(5).execute().data
-                appointments = self.db.table("appointments").select("*, users!doctor_id(*)").eq("patient_id", user_id).order("appointment_date").limit(5).execute().data
-                return render_template('patient/dashboard.html', patient_info=patient_info[0] if patient_info else {}, medical_records=records, appointments=appointments)
+                data = self.db.rpc("patient_dashboard", {"pid": g.user_id}).execute().data or {}
+                return render_template('patient/dashboard.html', patient_info=data.get('patient_info') or {}, medical_records=data.get('records') or [], appointments=data.get('appointments') or [])
             except Exception as e:
                 flash(f'Error loading dashboard: {e}', 'danger')
                 return render_template('patient/dashboard.html', patient_info={}, medical_records=[], appointments=[])
@@ -430,43 +1031,51 @@ class HealthcareApp:
         @self.role_required('doctor')
         def doctor_dashboard():
             try:
-                user_id = session['user_id']
-                doctor_info = self.db.table("medical_staff").select("*").eq("staff_id", user_id).execute().data
-                today = datetime.now().date().isoformat()
-                appointments = self.db.table("appointments").select("*, users!patient_id(*)").eq("doctor_id", user_id).gte("appointment_date", today).order("appointment_date").execute().data
-                return render_template('doctor/dashboard.html', doctor_info=doctor_info[0] if doctor_info else {}, appointments=appointments)
+                user_id = g.user_id
+                key = f'doctor_dashboard:{user_id}'
+                dashboard = self.cache.get(key)
+                if dashboard is None:
+                    staff, appointments, recent_patients = self.run_parallel(
+                        self._staff_query(),
+                        self.db.table("appointments").select("id, patient_id, appointment_date, appointment_time, reason, status, users!patient_id(first_name, last_name)").eq("doctor_id", user_id).gte("appointment_date", g.today_iso).order("appointment_date"),
+                        self.db.rpc("doctor_recent_patients", {"doc_id": user_id, "n": 5})
+                    )
+                    dashboard = {'doctor_info': self._current_staff(staff), 'appointments': appointments, 'recent_patients': recent_patients or []}
+                    self.cache.set(key, dashboard, timeout=self.app.config['DASHBOARD_CACHE_TTL'])
+                return render_template('doctor/dashboard.html', **dashboard)
             except Exception as e:
                 flash(f'Error loading dashboard: {e}', 'danger')
-                return render_template('doctor/dashboard.html', doctor_info={}, appointments=[])
+                return render_template('doctor/dashboard.html', doctor_info={}, appointments=[], recent_patients=[])
 
         @self.app.route('/nurse/dashboard')
         @self.role_required('nurse')
         def nurse_dashboard():
             try:
-                today = datetime.now().date().isoformat()
-                appointments = self.db.table("appointments").select("*, patient:users!patient_id(*), doctor:users!doctor_id(*)").gte("appointment_date", today).order("appointment_date").limit(20).execute().data
-                patients = self.db.table("users").select("*").eq("role", "patient").order("created_at", desc=True).limit(10).execute().data
-                return render_template('nurse/dashboard.html', appointments=appointments, recent_patients=patients)
+                # Upcoming appointments and new patients are the same for every nurse
+                shared = self.cache.get('nurse_dashboard')
+                if shared is None:
+                    staff, appointments, patients = self.run_parallel(
+                        self._staff_query(),
+                        self.db.table("appointments").select("id, patient_id, appointment_date, appointment_time, reason, status, patient:users!patient_id(first_name, last_name), doctor:users!doctor_id(first_name, last_name)").gte("appointment_date", g.today_iso).order("appointment_date").limit(20),
+                        self.db.table("users").select("id, first_name, last_name, phone_number").eq("role", "patient").order("created_at", desc=True).limit(10)
+                    )
+                    shared = {'appointments': appointments, 'recent_patients': patients}
+                    self.cache.set('nurse_dashboard', shared, timeout=self.app.config['DASHBOARD_CACHE_TTL'])
+                    nurse_info = self._current_staff(staff)
+                else:
+                    nurse_info = self._current_staff()
+                return render_template('nurse/dashboard.html', nurse_info=nurse_info, **shared)
             except Exception as e:
                 flash(f'Error loading dashboard: {e}', 'danger')
-                return render_template('nurse/dashboard.html', appointments=[], recent_patients=[])
+                return render_template('nurse/dashboard.html', nurse_info={}, appointments=[], recent_patients=[])
 
         @self.app.route('/admin/dashboard')
         @self.role_required('administrator')
         def admin_dashboard():
             try:
-                stats = {
-                    'patients': self.db.table("users").select("id", count="exact").eq("role", "patient").execute().count,
-                    'doctors': self.db.table("users").select("id", count="exact").eq("role", "doctor").execute().count,
-                    'nurses': self.db.table("users").select("id", count="exact").eq("role", "nurse").execute().count,
-                    'administrators': self.db.table("users").select("id", count="exact").eq("role", "administrator").execute().count,
-                    'appointments': self.db.table("appointments").select("id", count="exact").execute().count,
-                    'medical_records': self.db.table("medical_records").select("id", count="exact").execute().count
-                }
-                stats['total_users'] = stats['patients'] + stats['doctors'] + stats['nurses'] + stats['administrators']
-                
-                recent_users = self.db.table("users").select("*").order("created_at", desc=True).limit(10).execute().data
-                recent_logs = self.db.table("audit_logs").select("*, users(*)").order("created_at", desc=True).limit(15).execute().data
+                stats = self.get_admin_stats()
+                recent_users = stats.pop('recent_users', None) or []
+                recent_logs = stats.pop('recent_logs', None) or []
                 return render_template('admin/dashboard.html', stats=stats, recent_users=recent_users, recent_logs=recent_logs)
             except Exception as e:
                 flash(f'Error loading dashboard: {e}', 'danger')
@@ -476,28 +1085,85 @@ class HealthcareApp:
         @self.role_required('administrator')
         def api_admin_stats():
             try:
-                patients = self.db.table("users").select("id", count="exact").eq("role", "patient").execute().count
-                doctors = self.db.table("users").select("id", count="exact").eq("role", "doctor").execute().count
-                nurses = self.db.table("users").select("id", count="exact").eq("role", "nurse").execute().count
-                admins = self.db.table("users").select("id", count="exact").eq("role", "administrator").execute().count
-                
-                stats = {
-                    'patients': patients,
-                    'doctors': doctors,
-                    'nurses': nurses,
-                    'administrators': admins,
-                    'total_users': patients + doctors + nurses + admins,
-                    'appointments': self.db.table("appointments").select("id", count="exact").execute().count,
-                    'medical_records': self.db.table("medical_records").select("id", count="exact").execute().count
-                }
+                stats = self.get_admin_counts()
                 return jsonify({'success': True, 'stats': stats})
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)}), 500
 
+        @self.app.route('/api/users/search')
+        @self.role_required('doctor', 'nurse', 'administrator')
+        def api_user_search():
+            """Typeahead for the patient pickers: up to 20 users of a role whose last name starts with q"""
+            role = request.args.get('role', 'patient')
+            q = request.args.get('q', '').strip()
+            if role not in ('patient', 'doctor') or len(q) < 2:
+                return jsonify({'success': True, 'users': []})
+            # Typed % and _ are literal characters, not wildcards
+            pattern = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            users = self.db.table("users").select("id, first_name, last_name").eq("role", role).ilike("last_name", pattern).order("last_name").limit(20).execute().data
+            return jsonify({'success': True, 'users': users})
+
+        @self.app.route('/api/vital-signs', methods=['POST'])
+        @self.role_required('doctor', 'nurse')
+        def api_vital_signs():
+            """Record vitals from the nurse form, or a JSON list of samples, as one bulk insert"""
+            try:
+                samples = request.get_json() if request.is_json else [_form_dict(_VITAL_FIELDS)]
+                if isinstance(samples, dict):
+                    samples = [samples]
+                # Every row carries the same keys so PostgREST can insert the batch in one statement
+                rows = [{k: (sample.get(k) if sample.get(k) != '' else None) for k in _VITAL_FIELDS} for sample in samples]
+                if not rows or not all(row['patient_id'] for row in rows):
+                    return jsonify({'success': False, 'error': 'Please select a patient.'}), 400
+                for row in rows:
+                    row['recorded_by'] = g.user_id
+                result = self.db.table("vital_signs").insert(rows).execute()
+                for row in result.data:
+                    self.log_action(g.user_id, "VITAL_SIGNS_RECORDED", "vital_signs", row.get('id'))
+                return jsonify({'success': True, 'count': len(result.data)})
+            except Exception as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+
+        @self.app.route('/api/medical-records', methods=['POST'])
+        @self.role_required('doctor', 'nurse')
+        def api_medical_records():
+            """Bulk import: a JSON list of records inserted as one multi-row insert"""
+            try:
+                rows, error = self.medical_record_rows(request.get_data())
+                if error:
+                    return jsonify({'success': False, 'error': error}), 400
+                result = self.db.table("medical_records").insert(rows).execute()
+                for doctor_id in {row['doctor_id'] for row in rows}:
+                    self.invalidate_activity(doctor_id)
+                for row in result.data:
+                    self.log_action(g.user_id, "MEDICAL_RECORD_CREATED", "medical_records", row.get('id'))
+                return jsonify({'success': True, 'count': len(result.data)})
+            except Exception as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+
+        @self.app.route('/api/admin/medical-records/import', methods=['POST'])
+        @self.role_required('administrator')
+        def api_import_medical_records():
+            """Historical import: large record lists are streamed in with COPY instead of INSERT"""
+            try:
+                rows, error = self.medical_record_rows(request.get_data())
+                if error:
+                    return jsonify({'success': False, 'error': error}), 400
+                count = self.db.copy_rows("medical_records", _RECORD_FIELDS, rows)
+                if count is None:
+                    count = len(self.db.table("medical_records").insert(rows).execute().data)
+                for doctor_id in {row['doctor_id'] for row in rows}:
+                    self.invalidate_activity(doctor_id)
+                # COPY returns no ids, so the import is audited as one entry
+                self.log_action(g.user_id, "MEDICAL_RECORDS_IMPORTED", "medical_records")
+                return jsonify({'success': True, 'count': count})
+            except Exception as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+
         @self.app.route('/profile', methods=['GET', 'POST'])
         @self.login_required
         def profile():
-            user_id = session['user_id']
+            user_id = g.user_id
             if request.method == 'POST':
                 update_data = {
                     'first_name': request.form.get('first_name'),
@@ -506,110 +1172,206 @@ class HealthcareApp:
                     'phone_number': request.form.get('phone_number'),
                     'address': request.form.get('address')
                 }
-                self.db.table("users").update(update_data).eq("id", user_id).execute()
-                session['first_name'] = update_data['first_name']
-                session['last_name'] = update_data['last_name']
-                flash('Profile updated!', 'success')
+                if update_data['email'] and not validate_email(update_data['email']):
+                    flash('Please enter a valid email address.', 'danger')
+                else:
+                    self.db.table("users").update(update_data).eq("id", user_id).execute()
+                    self.refresh_cached_profile(user_id, update_data)
+                    self.cache.delete_many('doctors_list', 'doctor_options')
+                    self.log_action(user_id, "PROFILE_UPDATED", "users", user_id)
+                    session['first_name'] = update_data['first_name']
+                    session['last_name'] = update_data['last_name']
+                    flash('Profile updated!', 'success')
             
-            user_result = self.db.table("users").select("*").eq("id", user_id).execute()
-            if not user_result.data:
+            profile = self.get_profile(user_id, g.role)
+            if profile is None:
                 session.clear()
                 flash('User session invalid. Please log in again.', 'warning')
                 return redirect(url_for('login'))
                 
-            user_data = user_result.data[0]
-            return render_template('profile.html', user_data=user_data)
+            # The cached profile is written through on edits, so hashing it tracks updated_at without a query
+            version = lambda: orjson.dumps(profile, default=str, option=orjson.OPT_SORT_KEYS)
+            return self.conditional_page(version, lambda: render_template('profile.html', user_data=profile['user_data'], role_data=profile['role_data']))
 
         @self.app.route('/appointments')
         @self.login_required
         def appointments():
-            user_id = session['user_id']
-            role = session['role']
-            query = self.db.table("appointments").select("*, patient:users!patient_id(*), doctor:users!doctor_id(*)")
-            if role == 'patient': query = query.eq("patient_id", user_id)
-            elif role == 'doctor': query = query.eq("doctor_id", user_id)
-            result = query.order("appointment_date").execute()
-            return render_template('appointments/list.html', appointments=result.data)
+            user_id = g.user_id
+            role = g.role
+            def scoped(query):
+                if role == 'patient': return query.eq("patient_id", user_id)
+                if role == 'doctor': return query.eq("doctor_id", user_id)
+                return query
+            # Rows embed patient and doctor names from users, so renames must change the tag too
+            version = lambda: self.data_version(scoped(self.db.table("appointments").select("updated_at", count="exact")), self.db.table("users").select("updated_at"))
+
+            def render():
+                query = scoped(self.db.table("appointments").select("id, appointment_date, appointment_time, reason, status, patient:users!patient_id(first_name, last_name), doctor:users!doctor_id(first_name, last_name)"))
+                page, page_size = _page_args(self.app.config['ITEMS_PER_PAGE'])
+                start = (page - 1) * page_size
+                # One extra row tells whether there is a next page
+                rows = query.order("appointment_date").range(start, start + page_size).execute().data
+                prev_url = url_for('appointments', page=page - 1, page_size=page_size) if page > 1 else None
+                next_url = url_for('appointments', page=page + 1, page_size=page_size) if len(rows) > page_size else None
+                return render_template(self.template('appointments/list.html'), appointments=rows[:page_size], prev_url=prev_url, next_url=next_url)
+            return self.conditional_page(version, render)
 
         @self.app.route('/appointments/book', methods=['GET', 'POST'])
         @self.login_required
         def book_appointment():
             if request.method == 'POST':
                 data = {
-                    'patient_id': session['user_id'] if session['role'] == 'patient' else request.form.get('patient_id'),
+                    'patient_id': g.user_id if g.role == 'patient' else request.form.get('patient_id'),
                     'doctor_id': request.form.get('doctor_id'),
                     'appointment_date': request.form.get('appointment_date'),
                     'appointment_time': request.form.get('appointment_time'),
                     'reason': request.form.get('reason'),
-                    'status': 'scheduled'
+                    'status': 'scheduled',
+                    'idempotency_key': _idempotency_key()
                 }
-                self.db.table("appointments").insert(data).execute()
+                try:
+                    result = self.db.table("appointments").insert(data).execute()
+                except Exception as e:
+                    # A double-submitted form: the first request already booked it
+                    if self.duplicate_key_column(e) != 'idempotency_key':
+                        raise
+                    flash('Appointment booked!', 'success')
+                    return redirect(url_for('appointments'))
+                self.invalidate_activity(data['doctor_id'])
+                if result.data:
+                    self.log_action(g.user_id, "APPOINTMENT_BOOKED", "appointments", result.data[0]['id'])
                 flash('Appointment booked!', 'success')
                 return redirect(url_for('appointments'))
             
-            doctors = self.db.table("users").select("id, first_name, last_name").eq("role", "doctor").execute().data
-            patients = self.db.table("users").select("id, first_name, last_name").eq("role", "patient").execute().data if session['role'] != 'patient' else []
-            return render_template('appointments/book.html', doctors=doctors, patients=patients)
+            # Staff pick the patient through the /api/users/search typeahead
+            return render_template(self.template('appointments/book.html'), doctor_options=self.get_doctor_options(), idempotency_key=uuid.uuid4())
 
         @self.app.route('/appointments/<int:appointment_id>')
         @self.login_required
         def appointment_details(appointment_id):
-            result = self.db.table("appointments").select("*").eq("id", appointment_id).execute()
-            if not result.data: return redirect(url_for('appointments'))
+            # Patient and doctor come embedded, so the appointment and both parties are one query
+            query = self.db.table("appointments").select("id, patient_id, doctor_id, appointment_date, appointment_time, duration_minutes, status, reason, notes, patient:users!patient_id(id, first_name, last_name, email, phone_number), doctor:users!doctor_id(id, first_name, last_name, email, phone_number)").eq("id", appointment_id)
+            # Patients and doctors only see their own appointments; the filter keeps other rows in the DB
+            if g.role == 'patient': query = query.eq("patient_id", g.user_id)
+            elif g.role == 'doctor': query = query.eq("doctor_id", g.user_id)
+            result = query.execute()
+            if not result.data:
+                flash('Appointment not found.', 'warning')
+                return redirect(url_for('appointments'))
             app = result.data[0]
-            patient = self.db.table("users").select("*").eq("id", app['patient_id']).execute().data[0]
-            doctor = self.db.table("users").select("*").eq("id", app['doctor_id']).execute().data[0]
-            return render_template('appointments/details.html', appointment=app, patient=patient, doctor=doctor)
+            patient = app.pop('patient', None)
+            doctor = app.pop('doctor', None)
+            records = []
+            if g.role in ('doctor', 'nurse', 'administrator'):
+                records = self.db.table("medical_records").select("id, visit_date, diagnosis, treatment, users!doctor_id(first_name, last_name)").eq("patient_id", app['patient_id']).order("visit_date", desc=True).limit(5).execute().data
+            return render_template(self.template('appointments/details.html'), appointment=app, patient=patient, doctor=doctor, medical_records=records)
 
         @self.app.route('/patients')
         @self.role_required('doctor', 'nurse', 'administrator')
         def patients_list():
-            result = self.db.table("users").select("*").eq("role", "patient").order("first_name").execute()
-            return render_template('patients/list.html', patients=result.data)
+            # Keyset pagination in name order: constant cost no matter how deep the page
+            version = lambda: self.data_version(self.db.table("users").select("updated_at", count="exact").eq("role", "patient"))
+
+            def render():
+                _, page_size = _page_args(self.app.config['ITEMS_PER_PAGE'])
+                after = request.args.get('after', type=int)
+                params = {"n": page_size + 1}
+                if after:
+                    # The previous page's last row: (last_name, first_name, id), see get_patients_page()
+                    params.update(after_last=request.args.get('after_last', ''), after_first=request.args.get('after_first', ''), after_id=after)
+                rows = self.db.rpc("get_patients_page", params).execute().data or []
+                patients = rows[:page_size]
+                prev_url = url_for('patients_list', page_size=page_size) if after else None
+                next_url = None
+                if len(rows) > page_size:
+                    last = patients[-1]
+                    next_url = url_for('patients_list', after=last['id'], after_last=last['last_name'] or '', after_first=last['first_name'] or '', page_size=page_size)
+                return render_template(self.template('patients/list.html'), patients=patients, prev_url=prev_url, next_url=next_url, prev_label='First page')
+            return self.conditional_page(version, render)
 
         @self.app.route('/patients/<int:patient_id>')
         @self.role_required('doctor', 'nurse', 'administrator')
         def patient_details(patient_id):
-            patient = self.db.table("users").select("*").eq("id", patient_id).execute().data[0]
-            records = self.db.table("medical_records").select("*, users!doctor_id(*)").eq("patient_id", patient_id).order("visit_date", desc=True).execute().data
-            appointments = self.db.table("appointments").select("*, users!doctor_id(*)").eq("patient_id", patient_id).order("appointment_date").execute().data
-            return render_template('patients/details.html', patient=patient, medical_records=records, appointments=appointments)
+            page = self.db.rpc("get_patient_page", {"pid": patient_id}).execute().data or {}
+            if not page.get('patient'):
+                flash('Patient not found.', 'warning')
+                return redirect(url_for('patients_list'))
+            return render_template(
+                self.template('patients/details.html'), patient=page['patient'], patient_info=page.get('patient_info') or {},
+                medical_records=page['records'], record_count=page['record_count'],
+                appointments=page['appointments'], appointment_count=page['appointment_count']
+            )
 
         @self.app.route('/medical-records')
         @self.login_required
         def medical_records():
-            user_id = session['user_id']
-            role = session['role']
-            query = self.db.table("medical_records").select("*, patient:users!patient_id(*), doctor:users!doctor_id(*)")
-            if role == 'patient': query = query.eq("patient_id", user_id)
-            elif role == 'doctor': query = query.eq("doctor_id", user_id)
-            result = query.order("visit_date", desc=True).execute()
-            return render_template('medical_records/list.html', records=result.data)
+            user_id = g.user_id
+            role = g.role
+            def scoped(query):
+                if role == 'patient': return query.eq("patient_id", user_id)
+                if role == 'doctor': return query.eq("doctor_id", user_id)
+                return query
+            # Rows embed patient and doctor names from users, so renames must change the tag too
+            version = lambda: self.data_version(scoped(self.db.table("medical_records").select("updated_at", count="exact")), self.db.table("users").select("updated_at"))
+
+            def render():
+                query = scoped(self.db.table("medical_records").select("id, visit_date, symptoms, diagnosis, prescription, visit_type, patient:users!patient_id(first_name, last_name), doctor:users!doctor_id(first_name, last_name)"))
+                page, page_size = _page_args(self.app.config['ITEMS_PER_PAGE'])
+                start = (page - 1) * page_size
+                rows = query.order("visit_date", desc=True).range(start, start + page_size).execute().data
+                prev_url = url_for('medical_records', page=page - 1, page_size=page_size) if page > 1 else None
+                next_url = url_for('medical_records', page=page + 1, page_size=page_size) if len(rows) > page_size else None
+                return render_template(self.template('medical_records/list.html'), records=rows[:page_size], prev_url=prev_url, next_url=next_url)
+            return self.conditional_page(version, render)
 
         @self.app.route('/medical-records/add', methods=['GET', 'POST'])
         @self.role_required('doctor', 'nurse')
         def add_medical_record():
+            def form(idempotency_key):
+                doctor_options = self.get_doctor_options() if g.role == 'nurse' else ''
+                return render_template('medical_records/add.html', doctor_options=doctor_options, idempotency_key=idempotency_key)
+
             if request.method == 'POST':
-                data = {
-                    'patient_id': request.form.get('patient_id'),
-                    'doctor_id': session['user_id'] if session['role'] == 'doctor' else request.form.get('doctor_id'),
-                    'visit_date': request.form.get('visit_date'),
-                    'diagnosis': request.form.get('diagnosis'),
-                    'treatment': request.form.get('treatment'),
-                    'prescription': request.form.get('prescription'),
-                    'notes': request.form.get('notes'),
-                    'visit_type': request.form.get('visit_type', 'general')
-                }
-                self.db.table("medical_records").insert(data).execute()
+                # Blank fields are left to add_medical_record_tx (NULL, visit_type 'general')
+                data = _form_dict(_RECORD_FIELDS)
+                # Doctors file records under their own name whatever the form says
+                if g.role == 'doctor':
+                    data['doctor_id'] = g.user_id
+                # Reject incomplete picks here rather than through a foreign key error from the database
+                doctor_id = str(data.get('doctor_id') or '')
+                if not (data.get('patient_id') or '').isdigit() or not data.get('visit_date'):
+                    flash('Please choose a patient from the list and enter the visit date.', 'danger')
+                    return redirect(url_for('add_medical_record'))
+                if not doctor_id.isdigit() or int(doctor_id) not in self.doctor_ids():
+                    flash('Please choose a doctor from the list.', 'danger')
+                    return redirect(url_for('add_medical_record'))
+                # Lets add_medical_record_tx ignore a double-submitted form
+                data['idempotency_key'] = _idempotency_key()
+                data['audit'] = self.audit_entry(g.user_id, "MEDICAL_RECORD_CREATED", "medical_records")
+                # Record and audit row are written in one transaction (one commit, one round-trip)
+                try:
+                    record_id = self.db.rpc("add_medical_record_tx", {"payload": data}).execute().data
+                except Exception as e:
+                    print(f"Error adding medical record: {e}")
+                    record_id = None
+                # The function returns the record id; None means nothing was written
+                if not record_id:
+                    flash('The medical record could not be saved. Please try again.', 'danger')
+                    # Same key, so a retry of a write that did commit is still ignored
+                    return form(data['idempotency_key'] or uuid.uuid4())
+                self.invalidate_activity(data['doctor_id'])
                 flash('Record added!', 'success')
                 return redirect(url_for('medical_records'))
-            patients = self.db.table("users").select("id, first_name, last_name").eq("role", "patient").execute().data
-            doctors = self.db.table("users").select("id, first_name, last_name").eq("role", "doctor").execute().data if session['role'] == 'nurse' else []
-            return render_template('medical_records/add.html', patients=patients, doctors=doctors)
+            return form(uuid.uuid4())
 
-    def run(self, debug=True, host='127.0.0.1', port=5000):
+    def run(self, debug=False, host='127.0.0.1', port=5000):
         self.app.run(debug=debug, host=host, port=port)
 
+def create_app():
+    """WSGI entry point for production servers: gunicorn 'app:create_app()'"""
+    return HealthcareApp().app
+
 if __name__ == "__main__":
+    # Development server only; debug follows FLASK_DEBUG so it is never on by accident
     healthcare_app = HealthcareApp()
-    healthcare_app.run(debug=True)
+    healthcare_app.run(debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true')
@@ -0,0 +1,88 @@
+"""
+Healthcare Portal - Batched audit log writer.
+Shared by the web app and the CLI; has no Flask dependency.
+"""
+
+import atexit
+import queue
+import threading
+import time
+
+# Queued by close(): the writer thread writes what it holds and everything queued before it, then exits
+_STOP = object()
+
+class AuditLogWriter:
+    """Buffers audit_logs rows and inserts them in batches from a background thread"""
+    def __init__(self, db, buffer_size=500, flush_interval=5.0, max_queue=10000, close_timeout=10.0):
+        self.db = db
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.close_timeout = close_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._closed = threading.Event()
+        # Orders put() against close() so no entry can land in the queue behind _STOP
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, log_data):
+        with self._lock:
+            if not self._closed.is_set():
+                # Never block the request on audit persistence; drop when the buffer is full
+                try:
+                    self.queue.put_nowait(log_data)
+                except queue.Full:
+                    self.dropped += 1
+                    print(f"Warning: Audit queue full, dropped {log_data.get('action')} ({self.dropped} total)")
+                return
+        # The writer thread has been stopped; write inline rather than queue into nothing
+        self._write([log_data])
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            # Flush once buffer_size entries arrived or flush_interval passed since the first one
+            entry = self.queue.get()
+            if entry is _STOP:
+                break
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.buffer_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._write(batch)
+
+    def close(self):
+        """Stop the writer thread once it has written every queued entry (called at interpreter exit)"""
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            # Blocking put: the writer is draining the queue, so a full one frees up
+            self.queue.put(_STOP)
+        self._thread.join(self.close_timeout)
+        if self._thread.is_alive():
+            print(f"Warning: Audit writer still busy after {self.close_timeout}s, {self.queue.qsize()} entries unwritten")
+
+    def _write(self, batch):
+        try:
+            self.db.table("audit_logs").insert(batch).execute()
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Warning: Could not write audit log entry {batch[0].get('action')}: {e}")
+                return
+            # One bad row fails the whole insert; retry the rows one by one so the rest are kept
+            print(f"Warning: Audit batch of {len(batch)} failed ({e}), retrying entries individually")
+            for entry in batch:
+                self._write([entry])
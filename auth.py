@@ -0,0 +1,52 @@
+"""
+Healthcare Portal - Password hashing and credential validation.
+Shared by the web app and the CLI; has no Flask dependency.
+"""
+
+import hashlib
+import hmac
+import re
+import string
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHash, VerificationError
+
+PASSWORD_MIN_LENGTH = 8
+
+# Argon2id at 64 MiB / 3 passes (RFC 9106 second recommended option); hashes made with
+# other parameters are upgraded on the next login via password_needs_rehash()
+_hasher = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=2, hash_len=32, salt_len=16)
+# Verified against on unknown usernames so they cost the same time as a wrong password
+DUMMY_HASH = _hasher.hash("dummy-password")
+
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+_ASCII_LETTERS = frozenset(string.ascii_letters)
+_ASCII_DIGITS = frozenset(string.digits)
+
+def hash_password(password: str) -> str:
+    return _hasher.hash(password)
+
+def verify_password(stored_hash: str, password: str) -> bool:
+    if stored_hash.startswith('$argon2'):
+        try:
+            return _hasher.verify(stored_hash, password)
+        except (VerificationError, InvalidHash):
+            return False
+    # Legacy unsalted SHA-256 hashes (seed data and accounts created before Argon2)
+    legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(stored_hash, legacy_hash)
+
+def password_needs_rehash(stored_hash: str) -> bool:
+    return not stored_hash.startswith('$argon2') or _hasher.check_needs_rehash(stored_hash)
+
+def validate_password(password: str, min_length: int = PASSWORD_MIN_LENGTH) -> tuple[bool, str]:
+    if len(password) < min_length:
+        return False, f"Password must be at least {min_length} characters long"
+    if _ASCII_LETTERS.isdisjoint(password):
+        return False, "Password must contain at least one letter"
+    if _ASCII_DIGITS.isdisjoint(password):
+        return False, "Password must contain at least one number"
+    return True, ""
+
+def validate_email(email: str) -> bool:
+    # Cheap containment check rejects most junk before the regex runs
+    return '@' in email and _EMAIL_RE.match(email) is not None
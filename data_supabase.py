@@ -1,30 +1,144 @@
 import os
-import hashlib
+import sys
 import getpass
-from datetime import datetime
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from typing import Optional, Dict, Any
+from audit import AuditLogWriter
+from auth import DUMMY_HASH, hash_password, verify_password, password_needs_rehash
 
 # Load environment variables
 load_dotenv()
 
+# Settings are read once at import
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+PASSWORD_MIN_LENGTH = int(os.getenv("PASSWORD_MIN_LENGTH", 8))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", 300))
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 5))
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", 10000))
+
+# Rows per page in the CLI listings
+PAGE_SIZE = 50
+
+# Dashboard menus, formatted with the logged-in User
+_PATIENT_MENU = """
+=== Patient Dashboard ===
+Welcome, {user.first_name} {user.last_name}
+
+Available Options:
+1. View My Profile
+2. View My Medical Records
+3. View My Appointments
+4. Update Profile
+5. Logout"""
+
+_NURSE_MENU = """
+=== Nurse Dashboard ===
+Welcome, Nurse {user.first_name} {user.last_name}
+
+Available Options:
+1. View Patient List
+2. View My Schedule
+3. View Patient Details
+4. Update My Profile
+5. Logout"""
+
+_DOCTOR_MENU = """
+=== Doctor Dashboard ===
+Welcome, Dr. {user.last_name}
+
+Available Options:
+1. View Patient List
+2. View My Appointments
+3. View Patient Medical History
+4. Add Medical Record
+5. Update My Profile
+6. Logout"""
+
+_MAIN_MENU = """
+==================================================
+🏥 PATIENT DATA MANAGEMENT SYSTEM
+==================================================
+1. Login
+2. Register
+3. Test Database Connection
+4. Exit"""
+
+_ADMIN_MENU = """
+=== Administrator Dashboard ===
+Welcome, {user.first_name} {user.last_name}
+
+Available Options:
+1. View All Users
+2. View System Statistics
+3. View Audit Logs
+4. Manage Users
+5. Update My Profile
+6. Logout"""
+
+@dataclass
+class User:
+    """The logged-in user, as read at login"""
+    __slots__ = ('id', 'username', 'role', 'first_name', 'last_name', 'email', 'phone_number', 'address')
+    id: int
+    username: str
+    role: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    email: Optional[str]
+    phone_number: Optional[str]
+    address: Optional[str]
+
+def _embedded_one(value) -> dict:
+    """A one-to-one embed: PostgREST returns an object, or a list on older versions"""
+    if isinstance(value, list):
+        return value[0] if value else {}
+    return value or {}
+
+def _pgrst_quote(value) -> str:
+    """Quote a value for a raw PostgREST logic-tree string (.or_()), where , ( ) would otherwise be syntax"""
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+@lru_cache(maxsize=1)
+def get_client() -> Client:
+    """Process-wide Supabase client; every HealthcareSystem shares its HTTP connections"""
+    if not SUPABASE_URL or not SUPABASE_ANON_KEY:
+        raise ValueError("Supabase URL and ANON_KEY must be set in .env file")
+    
+    return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+
+@lru_cache(maxsize=1)
+def get_audit_log() -> AuditLogWriter:
+    """Process-wide audit writer: one bounded queue and one flush thread, however many HealthcareSystems exist"""
+    return AuditLogWriter(
+        get_client(),
+        buffer_size=AUDIT_BUFFER_SIZE,
+        flush_interval=AUDIT_FLUSH_INTERVAL,
+        max_queue=AUDIT_QUEUE_MAX
+    )
+
 class HealthcareSystem:
     def __init__(self):
         self.supabase = None
+        self.audit_log = None
         self.current_user = None
+        # Profile rows by user id: (expiry, row); dropped on update_profile
+        self.profile_cache = {}
         self.connect_to_database()
     
     def connect_to_database(self):
         """Establish connection to Supabase database"""
         try:
-            url = os.getenv("SUPABASE_URL")
-            key = os.getenv("SUPABASE_ANON_KEY")
-            
-            if not url or not key:
-                raise ValueError("Supabase URL and ANON_KEY must be set in .env file")
-            
-            self.supabase = create_client(url, key)
+            self.supabase = get_client()
+            # Audit rows are queued and inserted in batches; close() writes anything pending
+            self.audit_log = get_audit_log()
             print("Successfully connected to Supabase database!")
             
         except Exception as e:
@@ -32,12 +146,12 @@ class HealthcareSystem:
             self.supabase = None
     
     def hash_password(self, password: str) -> str:
-        """Hash password using SHA-256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password with Argon2id; the encoded hash carries its own salt and parameters"""
+        return hash_password(password)
     
     def validate_password(self, password: str) -> bool:
         """Validate password meets minimum requirements"""
-        min_length = int(os.getenv("PASSWORD_MIN_LENGTH", 8))
+        min_length = PASSWORD_MIN_LENGTH
         
         if len(password) < min_length:
             print(f"Password must be at least {min_length} characters long")
@@ -46,6 +160,23 @@ class HealthcareSystem:
         # Additional password validation can be added here
         return True
     
+    def page_through(self, fetch, show, cursor_of):
+        """Show a listing one page at a time.
+
+        fetch(cursor) returns up to PAGE_SIZE + 1 rows following cursor (None for the first page);
+        the extra row only tells whether a next page exists. cursor_of(row) is the keyset value
+        the next page starts after, so each page is an index range scan rather than an OFFSET.
+        """
+        cursor = None
+        while True:
+            rows = fetch(cursor)
+            show(rows[:PAGE_SIZE])
+            if len(rows) <= PAGE_SIZE:
+                return
+            if input("Press Enter for the next page, or q to stop: ").strip().lower() == 'q':
+                return
+            cursor = cursor_of(rows[PAGE_SIZE - 1])
+    
     def register_user(self):
         """Register a new user"""
         if not self.supabase:
@@ -54,31 +185,43 @@ class HealthcareSystem:
         
         print("\n=== User Registration ===")
         
-        # Get user input
+        # Every prompt is answered before the account is written, so the write is a single burst
+        user_data = self.collect_registration()
+        if user_data:
+            self.persist_registration(user_data)
+    
+    def is_taken(self, column: str, value: str) -> Optional[bool]:
+        """Whether a users row already has this value (at most one id comes back); None on error"""
+        try:
+            return bool(self.supabase.table("users").select("id").eq(column, value).limit(1).execute().data)
+        except Exception as e:
+            print(f"Error checking {column}: {e}")
+            return None
+    
+    def collect_registration(self) -> Optional[dict]:
+        """Prompt for every registration field; returns the register_user payload, or None if the user must start over"""
         username = input("Username: ").strip()
         if not username:
             print("Username cannot be empty!")
-            return
+            return None
         
-        # Check if username already exists
-        try:
-            existing_user = self.supabase.table("users").select("id").eq("username", username).execute()
-            if existing_user.data:
-                print("Username already exists!")
-                return
-        except Exception as e:
-            print(f"Error checking username: {e}")
-            return
+        # Checked early so nobody types the whole form for a taken username
+        taken = self.is_taken("username", username)
+        if taken is None:
+            return None
+        if taken:
+            print("Username already exists!")
+            return None
         
         password = getpass.getpass("Password: ")
         if not self.validate_password(password):
-            return
+            return None
             
         confirm_password = getpass.getpass("Confirm Password: ")
         
         if password != confirm_password:
             print("Passwords do not match!")
-            return
+            return None
         
         # Role selection
         print("\nAvailable Roles:")
@@ -93,87 +236,70 @@ class HealthcareSystem:
         
         if not role:
             print("Invalid role selection!")
-            return
+            return None
         
         # Additional information
         email = input("Email: ").strip()
         if email:
-            # Check if email already exists
-            try:
-                existing_email = self.supabase.table("users").select("id").eq("email", email).execute()
-                if existing_email.data:
-                    print("Email already registered!")
-                    return
-            except Exception as e:
-                print(f"Error checking email: {e}")
-                return
+            taken = self.is_taken("email", email)
+            if taken is None:
+                return None
+            if taken:
+                print("Email already registered!")
+                return None
         
         first_name = input("First Name: ").strip()
         last_name = input("Last Name: ").strip()
         phone_number = input("Phone Number (optional): ").strip() or None
         address = input("Address (optional): ").strip() or None
         
-        try:
-            # Insert new user
-            hashed_password = self.hash_password(password)
-            
-            user_data = {
-                "username": username,
-                "password": hashed_password,
-                "role": role,
-                "email": email if email else None,
-                "first_name": first_name,
-                "last_name": last_name,
-                "phone_number": phone_number,
-                "address": address
+        # Role-specific details are collected up front so the account is created in one call
+        profile_data = {}
+        if role == 'patient':
+            profile_data = {
+                "emergency_contact": input("Emergency Contact: ").strip() or None,
+                "insurance_info": input("Insurance Information: ").strip() or None,
+                "blood_type": input("Blood Type (optional): ").strip() or None
             }
+        elif role in ['doctor', 'nurse']:
+            profile_data = {
+                "specialization": input("Specialization: ").strip() if role == 'doctor' else "Nursing",
+                "license_number": input("License Number: ").strip(),
+                "department": input("Department: ").strip() or None
+            }
+        
+        return {
+            "username": username,
+            "password": self.hash_password(password),
+            "role": role,
+            "email": email if email else None,
+            "first_name": first_name,
+            "last_name": last_name,
+            "phone_number": phone_number,
+            "address": address,
+            **profile_data,
+            "audit": {"action": "USER_REGISTERED", "table_name": "users", "user_agent": "CLI"}
+        }
+    
+    def persist_registration(self, user_data: dict):
+        """Create the account from a collect_registration() payload"""
+        try:
+            # register_user (sql/functions.sql) inserts the users row, its patients /
+            # medical_staff row and the audit entry in one transaction, so a failure
+            # leaves no orphaned user
+            user_id = self.supabase.rpc("register_user", {"payload": user_data}).execute().data
             
-            # Insert user
-            result = self.supabase.table("users").insert(user_data).execute()
-            
-            if not result.data:
+            if not user_id:
                 print("Error creating user account")
                 return
             
-            user_id = result.data[0]["id"]
-            
-            # Insert into role-specific tables
-            if role == 'patient':
-                emergency_contact = input("Emergency Contact: ").strip() or None
-                insurance_info = input("Insurance Information: ").strip() or None
-                blood_type = input("Blood Type (optional): ").strip() or None
-                
-                patient_data = {
-                    "patient_id": user_id,
-                    "emergency_contact": emergency_contact,
-                    "insurance_info": insurance_info,
-                    "blood_type": blood_type
-                }
-                
-                self.supabase.table("patients").insert(patient_data).execute()
-            
-            elif role in ['doctor', 'nurse']:
-                specialization = input("Specialization: ").strip() if role == 'doctor' else "Nursing"
-                license_number = input("License Number: ").strip()
-                department = input("Department: ").strip() or None
-                
-                staff_data = {
-                    "staff_id": user_id,
-                    "specialization": specialization,
-                    "license_number": license_number,
-                    "hire_date": datetime.now().date().isoformat(),
-                    "department": department,
-                    "status": "active"
-                }
-                
-                self.supabase.table("medical_staff").insert(staff_data).execute()
-            
-            print(f"\n✅ Registration successful! Welcome, {first_name}!")
-            
-            # Log the registration
-            self.log_action(user_id, "USER_REGISTERED", "users", user_id)
+            print(f"\n✅ Registration successful! Welcome, {user_data['first_name']}!")
             
         except Exception as e:
+            # The early checks can race with another registration; the UNIQUE constraints still hold
+            if getattr(e, 'code', None) == '23505':
+                print("Username, email or license number already registered!")
+                return
             print(f"Error during registration: {e}")
     
     def login_user(self):
@@ -188,25 +314,32 @@ class HealthcareSystem:
         password = getpass.getpass("Password: ")
         
         try:
-            hashed_password = self.hash_password(password)
-            
-            # Check user credentials
+            # Fetch the stored hash by username and verify it here; Argon2 hashes are salted,
+            # so they cannot be matched with an equality filter
             result = self.supabase.table("users").select(
-                "id, username, role, first_name, last_name, email"
-            ).eq("username", username).eq("password", hashed_password).execute()
-            
-            if result.data:
-                user = result.data[0]
+                "id, username, password, role, first_name, last_name, email, phone_number, address"
+            ).eq("username", username).execute()
+            
+            user = result.data[0] if result.data else None
+            if user is None:
+                # Unknown usernames cost the same time as a wrong password
+                verify_password(DUMMY_HASH, password)
+            elif verify_password(user['password'], password):
+                stored_hash = user.pop('password')
+                # Upgrades legacy SHA-256 hashes and outdated Argon2 parameters on login
+                if password_needs_rehash(stored_hash):
+                    self.supabase.table("users").update({"password": self.hash_password(password)}).eq("id", user['id']).execute()
+                user = User(**user)
                 self.current_user = user
-                print(f"\n✅ Login successful! Welcome, {user['first_name']}!")
-                print(f"Role: {user['role'].title()}")
+                print(f"\n✅ Login successful! Welcome, {user.first_name}!")
+                print(f"Role: {user.role.title()}")
                 
                 # Log the login
-                self.log_action(user['id'], "USER_LOGIN", "users", user['id'])
+                self.log_action(user.id, "USER_LOGIN", "users", user.id)
                 
                 self.show_user_dashboard(user)
-            else:
-                print("❌ Invalid username or password!")
+                return
+            print("❌ Invalid username or password!")
                 
         except Exception as e:
             print(f"Error during login: {e}")
@@ -215,22 +348,24 @@ class HealthcareSystem:
                   old_values: dict = None, new_values: dict = None):
         """Log user actions for audit purposes"""
         try:
-            if self.supabase:
+            if self.audit_log:
                 log_data = {
                     "user_id": user_id,
                     "action": action,
                     "table_name": table_name,
                     "record_id": record_id,
                     "old_values": old_values,
-                    "new_values": new_values
+                    "new_values": new_values,
+                    # Stamped here because the row is written later by the background writer
+                    "created_at": datetime.now(timezone.utc).isoformat()
                 }
-                self.supabase.table("audit_logs").insert(log_data).execute()
+                self.audit_log.put(log_data)
         except Exception as e:
             print(f"Warning: Could not log action: {e}")
     
-    def show_user_dashboard(self, user: dict):
+    def show_user_dashboard(self, user: User):
         """Show role-specific dashboard"""
-        role = user['role']
+        role = user.role
         
         if role == 'patient':
             self.patient_dashboard(user)
@@ -241,150 +376,87 @@ class HealthcareSystem:
         elif role == 'administrator':
             self.admin_dashboard(user)
     
-    def patient_dashboard(self, user: dict):
-        """Patient-specific dashboard"""
+    def run_dashboard(self, menu: str, user: User, actions: dict):
+        """Show a dashboard menu until Logout, the option numbered after the last action"""
+        logout = str(len(actions) + 1)
+        prompt = f"Select option (1-{logout}): "
         while True:
-            print(f"\n=== Patient Dashboard ===")
-            print(f"Welcome, {user['first_name']} {user['last_name']}")
-            print("\nAvailable Options:")
-            print("1. View My Profile")
-            print("2. View My Medical Records")
-            print("3. View My Appointments") 
-            print("4. Update Profile")
-            print("5. Logout")
-            
-            choice = input("Select option (1-5): ").strip()
+            print(menu.format(user=user))
+            choice = input(prompt).strip()
             
-            if choice == '1':
-                self.view_patient_profile(user['id'])
-            elif choice == '2':
-                self.view_medical_records(user['id'])
-            elif choice == '3':
-                self.view_appointments(user['id'])
-            elif choice == '4':
-                self.update_profile(user)
-            elif choice == '5':
+            if choice == logout:
                 print("Logging out...")
                 self.current_user = None
                 break
+            action = actions.get(choice)
+            if action:
+                action()
             else:
                 print("Invalid option! Please try again.")
     
-    def nurse_dashboard(self, user: dict):
+    def with_patient_id(self, view):
+        """Prompt for a patient ID and pass it to view"""
+        patient_id = input("Enter Patient ID: ").strip()
+        if patient_id.isdigit():
+            view(int(patient_id))
+        else:
+            print("Invalid Patient ID")
+    
+    def patient_dashboard(self, user: User):
+        """Patient-specific dashboard"""
+        self.run_dashboard(_PATIENT_MENU, user, {
+            '1': lambda: self.view_patient_profile(user.id),
+            '2': lambda: self.view_medical_records(user.id),
+            '3': lambda: self.view_appointments(user.id),
+            '4': lambda: self.update_profile(user),
+        })
+    
+    def nurse_dashboard(self, user: User):
         """Nurse-specific dashboard"""
-        while True:
-            print(f"\n=== Nurse Dashboard ===")
-            print(f"Welcome, Nurse {user['first_name']} {user['last_name']}")
-            print("\nAvailable Options:")
-            print("1. View Patient List")
-            print("2. View My Schedule")
-            print("3. View Patient Details")
-            print("4. Update My Profile")
-            print("5. Logout")
-            
-            choice = input("Select option (1-5): ").strip()
-            
-            if choice == '1':
-                self.view_patient_list()
-            elif choice == '2':
-                self.view_schedule(user['id'])
-            elif choice == '3':
-                patient_id = input("Enter Patient ID: ").strip()
-                if patient_id.isdigit():
-                    self.view_patient_details(int(patient_id))
-                else:
-                    print("Invalid Patient ID")
-            elif choice == '4':
-                self.update_profile(user)
-            elif choice == '5':
-                print("Logging out...")
-                self.current_user = None
-                break
-            else:
-                print("Invalid option! Please try again.")
+        self.run_dashboard(_NURSE_MENU, user, {
+            '1': self.view_patient_list,
+            '2': lambda: self.view_schedule(user.id),
+            '3': lambda: self.with_patient_id(self.view_patient_details),
+            '4': lambda: self.update_profile(user),
+        })
     
-    def doctor_dashboard(self, user: dict):
+    def doctor_dashboard(self, user: User):
         """Doctor-specific dashboard"""
-        while True:
-            print(f"\n=== Doctor Dashboard ===")
-            print(f"Welcome, Dr. {user['last_name']}")
-            print("\nAvailable Options:")
-            print("1. View Patient List")
-            print("2. View My Appointments")
-            print("3. View Patient Medical History")
-            print("4. Add Medical Record")
-            print("5. Update My Profile")
-            print("6. Logout")
-            
-            choice = input("Select option (1-6): ").strip()
-            
-            if choice == '1':
-                self.view_patient_list()
-            elif choice == '2':
-                self.view_appointments(user['id'], is_doctor=True)
-            elif choice == '3':
-                patient_id = input("Enter Patient ID: ").strip()
-                if patient_id.isdigit():
-                    self.view_medical_records(int(patient_id))
-                else:
-                    print("Invalid Patient ID")
-            elif choice == '4':
-                self.add_medical_record(user['id'])
-            elif choice == '5':
-                self.update_profile(user)
-            elif choice == '6':
-                print("Logging out...")
-                self.current_user = None
-                break
-            else:
-                print("Invalid option! Please try again.")
+        self.run_dashboard(_DOCTOR_MENU, user, {
+            '1': self.view_patient_list,
+            '2': lambda: self.view_appointments(user.id, is_doctor=True),
+            '3': lambda: self.with_patient_id(self.view_medical_records),
+            '4': lambda: self.add_medical_record(user.id),
+            '5': lambda: self.update_profile(user),
+        })
     
-    def admin_dashboard(self, user: dict):
+    def admin_dashboard(self, user: User):
         """Administrator-specific dashboard"""
-        while True:
-            print(f"\n=== Administrator Dashboard ===")
-            print(f"Welcome, {user['first_name']} {user['last_name']}")
-            print("\nAvailable Options:")
-            print("1. View All Users")
-            print("2. View System Statistics")
-            print("3. View Audit Logs")
-            print("4. Manage Users")
-            print("5. Update My Profile")
-            print("6. Logout")
-            
-            choice = input("Select option (1-6): ").strip()
-            
-            if choice == '1':
-                self.view_all_users()
-            elif choice == '2':
-                self.view_system_stats()
-            elif choice == '3':
-                self.view_audit_logs()
-            elif choice == '4':
-                self.manage_users()
-            elif choice == '5':
-                self.update_profile(user)
-            elif choice == '6':
-                print("Logging out...")
-                self.current_user = None
-                break
-            else:
-                print("Invalid option! Please try again.")
+        self.run_dashboard(_ADMIN_MENU, user, {
+            '1': self.view_all_users,
+            '2': self.view_system_stats,
+            '3': self.view_audit_logs,
+            '4': self.manage_users,
+            '5': lambda: self.update_profile(user),
+        })
     
     def view_patient_profile(self, patient_id: int):
         """View patient profile information"""
         try:
-            # Get user info
-            user_result = self.supabase.table("users").select("*").eq("id", patient_id).execute()
-            if not user_result.data:
-                print("Patient not found")
-                return
-                
-            user = user_result.data[0]
-            
-            # Get patient-specific info
-            patient_result = self.supabase.table("patients").select("*").eq("patient_id", patient_id).execute()
-            patient_info = patient_result.data[0] if patient_result.data else {}
+            expires, user = self.profile_cache.get(patient_id, (0, None))
+            if expires < time.monotonic():
+                # The patients row comes embedded, so the profile is one round-trip
+                user_result = self.supabase.table("users").select(
+                    "first_name, last_name, username, email, phone_number, address, "
+                    "patients(emergency_contact, insurance_info, blood_type)"
+                ).eq("id", patient_id).execute()
+                if not user_result.data:
+                    print("Patient not found")
+                    return
+                    
+                user = user_result.data[0]
+                self.profile_cache[patient_id] = (time.monotonic() + PROFILE_CACHE_TTL, user)
+            patient_info = _embedded_one(user.get('patients'))
             
             print(f"\n=== Patient Profile ===")
             print(f"Name: {user['first_name']} {user['last_name']}")
@@ -402,8 +474,9 @@ class HealthcareSystem:
     def view_medical_records(self, patient_id: int):
         """View medical records for a patient"""
         try:
+            # The doctor embed is joined inside the same PostgREST query; only printed columns are fetched
             result = self.supabase.table("medical_records").select(
-                "*, users!doctor_id(first_name, last_name)"
+                "visit_date, diagnosis, treatment, prescription, notes, users!doctor_id(first_name, last_name)"
             ).eq("patient_id", patient_id).order("visit_date", desc=True).execute()
             
             if not result.data:
@@ -431,12 +504,12 @@ class HealthcareSystem:
         try:
             if is_doctor:
                 result = self.supabase.table("appointments").select(
-                    "*, users!patient_id(first_name, last_name)"
+                    "appointment_date, duration_minutes, status, reason, notes, users!patient_id(first_name, last_name)"
                 ).eq("doctor_id", user_id).order("appointment_date", desc=False).execute()
                 user_type = "doctor"
             else:
                 result = self.supabase.table("appointments").select(
-                    "*, users!doctor_id(first_name, last_name)"  
+                    "appointment_date, duration_minutes, status, reason, notes, users!doctor_id(first_name, last_name)"
                 ).eq("patient_id", user_id).order("appointment_date", desc=False).execute()
                 user_type = "patient"
             
@@ -466,12 +539,17 @@ class HealthcareSystem:
     
     def view_patient_list(self):
         """View list of all patients (for medical staff)"""
-        try:
-            result = self.supabase.table("users").select(
+        def fetch(after):
+            # Keyset on id, served by idx_users_role_id (role, id)
+            query = self.supabase.table("users").select(
                 "id, first_name, last_name, email, phone_number"
-            ).eq("role", "patient").execute()
-            
-            if not result.data:
+            ).eq("role", "patient")
+            if after is not None:
+                query = query.gt("id", after)
+            return query.order("id").limit(PAGE_SIZE + 1).execute().data
+        
+        def show(patients):
+            if not patients:
                 print("No patients found")
                 return
             
@@ -479,25 +557,27 @@ class HealthcareSystem:
             print(f"{'ID':<5} {'Name':<25} {'Email':<25} {'Phone':<15}")
             print("-" * 70)
             
-            for patient in result.data:
-                name = f"{patient.get('first_name', '')} {patient.get('last_name', '')}"
-                email = patient.get('email', 'N/A')
-                phone = patient.get('phone_number', 'N/A')
-                print(f"{patient['id']:<5} {name:<25} {email:<25} {phone:<15}")
-                
+            # The whole page goes out in one write
+            sys.stdout.writelines([
+                f"{p['id']:<5} {(p['first_name'] or '') + ' ' + (p['last_name'] or ''):<25} {p['email'] or 'N/A':<25} {p['phone_number'] or 'N/A':<15}\n"
+                for p in patients
+            ])
+        
+        try:
+            self.page_through(fetch, show, lambda patient: patient['id'])
         except Exception as e:
             print(f"Error viewing patient list: {e}")
     
-    def update_profile(self, user: dict):
+    def update_profile(self, user: User):
         """Update user profile"""
         print(f"\n=== Update Profile ===")
         print("Leave blank to keep current value")
         
-        first_name = input(f"First Name ({user.get('first_name', '')}): ").strip()
-        last_name = input(f"Last Name ({user.get('last_name', '')}): ").strip()
-        email = input(f"Email ({user.get('email', '')}): ").strip()
-        phone = input(f"Phone ({user.get('phone_number', '')}): ").strip()
-        address = input(f"Address ({user.get('address', '')}): ").strip()
+        first_name = input(f"First Name ({user.first_name or ''}): ").strip()
+        last_name = input(f"Last Name ({user.last_name or ''}): ").strip()
+        email = input(f"Email ({user.email or ''}): ").strip()
+        phone = input(f"Phone ({user.phone_number or ''}): ").strip()
+        address = input(f"Address ({user.address or ''}): ").strip()
         
         update_data = {}
         if first_name:
@@ -513,13 +593,15 @@ class HealthcareSystem:
         
         if update_data:
             try:
-                self.supabase.table("users").update(update_data).eq("id", user['id']).execute()
+                self.supabase.table("users").update(update_data).eq("id", user.id).execute()
                 print("✅ Profile updated successfully!")
                 
                 # Update current user data
-                user.update(update_data)
+                for field, value in update_data.items():
+                    setattr(user, field, value)
+                self.profile_cache.pop(user.id, None)
                 
-                self.log_action(user['id'], "PROFILE_UPDATED", "users", user['id'])
+                self.log_action(user.id, "PROFILE_UPDATED", "users", user.id)
                 
             except Exception as e:
                 print(f"Error updating profile: {e}")
@@ -575,63 +657,69 @@ class HealthcareSystem:
     
     def view_all_users(self):
         """View all users (admin only)"""
-        try:
-            result = self.supabase.table("users").select(
+        def fetch(before):
+            # Newest first by id: ids follow creation order, and unlike created_at they never tie
+            query = self.supabase.table("users").select(
                 "id, username, role, first_name, last_name, email, created_at"
-            ).order("created_at", desc=True).execute()
-            
+            )
+            if before is not None:
+                query = query.lt("id", before)
+            return query.order("id", desc=True).limit(PAGE_SIZE + 1).execute().data
+        
+        def show(users):
             print(f"\n=== All Users ===")
             print(f"{'ID':<5} {'Username':<15} {'Role':<12} {'Name':<25} {'Email':<25} {'Created':<12}")
             print("-" * 100)
             
-            for user in result.data:
+            for user in users:
                 name = f"{user.get('first_name', '')} {user.get('last_name', '')}"
                 email = user.get('email', 'N/A')
                 created = user['created_at'][:10] if user.get('created_at') else 'N/A'
                 
                 print(f"{user['id']:<5} {user['username']:<15} {user['role']:<12} {name:<25} {email:<25} {created:<12}")
-                
+        
+        try:
+            self.page_through(fetch, show, lambda user: user['id'])
         except Exception as e:
             print(f"Error viewing users: {e}")
     
     def view_system_stats(self):
         """View system statistics (admin only)"""
         try:
-            # Count users by role
-            patients = self.supabase.table("users").select("id", count="exact").eq("role", "patient").execute()
-            doctors = self.supabase.table("users").select("id", count="exact").eq("role", "doctor").execute()
-            nurses = self.supabase.table("users").select("id", count="exact").eq("role", "nurse").execute()
-            admins = self.supabase.table("users").select("id", count="exact").eq("role", "administrator").execute()
-            
-            # Count appointments
-            appointments = self.supabase.table("appointments").select("id", count="exact").execute()
-            
-            # Count medical records
-            records = self.supabase.table("medical_records").select("id", count="exact").execute()
+            # get_admin_counts (sql/functions.sql) returns every count in one round-trip,
+            # with the role counts taken in a single pass over users
+            stats = self.supabase.rpc("get_admin_counts", {}).execute().data or {}
             
             print(f"\n=== System Statistics ===")
-            print(f"Total Patients: {patients.count}")
-            print(f"Total Doctors: {doctors.count}")
-            print(f"Total Nurses: {nurses.count}")
-            print(f"Total Administrators: {admins.count}")
-            print(f"Total Users: {patients.count + doctors.count + nurses.count + admins.count}")
-            print(f"Total Appointments: {appointments.count}")
-            print(f"Total Medical Records: {records.count}")
+            print(f"Total Patients: {stats.get('patients', 0)}")
+            print(f"Total Doctors: {stats.get('doctors', 0)}")
+            print(f"Total Nurses: {stats.get('nurses', 0)}")
+            print(f"Total Administrators: {stats.get('administrators', 0)}")
+            print(f"Total Users: {stats.get('total_users', 0)}")
+            print(f"Total Appointments: {stats.get('appointments', 0)}")
+            print(f"Total Medical Records: {stats.get('medical_records', 0)}")
             
         except Exception as e:
             print(f"Error viewing statistics: {e}")
     
     def view_audit_logs(self):
         """View recent audit logs (admin only)"""
-        try:
-            result = self.supabase.table("audit_logs").select(
-                "*, users(username, first_name, last_name)"
-            ).order("created_at", desc=True).limit(20).execute()
-            
+        def fetch(before):
+            # Keyset on (created_at, id): created_at is the partition key, so older pages only touch
+            # older partitions, and id breaks ties between entries written in the same batch
+            query = self.supabase.table("audit_logs").select(
+                "id, action, table_name, created_at, users(username, first_name, last_name)"
+            )
+            if before is not None:
+                created_at, log_id = map(_pgrst_quote, before)
+                query = query.or_(f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{log_id})")
+            return query.order("created_at", desc=True).order("id", desc=True).limit(PAGE_SIZE + 1).execute().data
+        
+        def show(logs):
             print(f"\n=== Recent Audit Logs ===")
-            for log in result.data:
-                user = log.get('users', {})
-                username = user.get('username', 'System')
+            for log in logs:
+                # users is null for entries without a user (e.g. web registrations)
+                username = _embedded_one(log.get('users')).get('username', 'System')
                 timestamp = log['created_at'][:19] if log.get('created_at') else 'N/A'
                 
                 print(f"Time: {timestamp}")
@@ -639,7 +727,9 @@ class HealthcareSystem:
                 print(f"Action: {log['action']}")
                 print(f"Table: {log.get('table_name', 'N/A')}")
                 print("-" * 40)
-                
+        
+        try:
+            self.page_through(fetch, show, lambda log: (log['created_at'], log['id']))
         except Exception as e:
             print(f"Error viewing audit logs: {e}")
     
@@ -657,7 +747,7 @@ class HealthcareSystem:
         """View schedule (for nurses/doctors)"""
         try:
             result = self.supabase.table("appointments").select(
-                "*, users!patient_id(first_name, last_name)"
+                "appointment_date, duration_minutes, reason, users!patient_id(first_name, last_name)"
             ).eq("doctor_id", user_id).gte(
                 "appointment_date", datetime.now().isoformat()
             ).order("appointment_date", desc=False).limit(10).execute()
@@ -683,17 +773,21 @@ class HealthcareSystem:
     def view_patient_details(self, patient_id: int):
         """View detailed patient information (for medical staff)"""
         try:
-            # Get user info
-            user_result = self.supabase.table("users").select("*").eq("id", patient_id).eq("role", "patient").execute()
+            # One round-trip: the patients row and the 3 latest records come embedded in the users row
+            user_result = self.supabase.table("users").select(
+                "first_name, last_name, email, phone_number, address, date_of_birth, "
+                "patients(emergency_contact, insurance_info, blood_type, medical_history, allergies), "
+                "medical_records!patient_id(visit_date, diagnosis, treatment)"
+            ).eq("id", patient_id).eq("role", "patient").order(
+                "visit_date", desc=True, foreign_table="medical_records"
+            ).limit(3, foreign_table="medical_records").execute()
             if not user_result.data:
                 print("Patient not found")
                 return
                 
             user = user_result.data[0]
-            
-            # Get patient-specific info
-            patient_result = self.supabase.table("patients").select("*").eq("patient_id", patient_id).execute()
-            patient_info = patient_result.data[0] if patient_result.data else {}
+            patient_info = _embedded_one(user.get('patients'))
+            records = user.get('medical_records') or []
             
             print(f"\n=== Patient Details ===")
             print(f"Name: {user['first_name']} {user['last_name']}")
@@ -707,14 +801,9 @@ class HealthcareSystem:
             print(f"Medical History: {patient_info.get('medical_history', 'Not provided')}")
             print(f"Allergies: {patient_info.get('allergies', 'Not provided')}")
             
-            # Recent medical records
-            records = self.supabase.table("medical_records").select(
-                "visit_date, diagnosis, treatment"
-            ).eq("patient_id", patient_id).order("visit_date", desc=True).limit(3).execute()
-            
-            if records.data:
+            if records:
                 print(f"\n=== Recent Medical Records ===")
-                for record in records.data:
+                for record in records:
                     print(f"Date: {record['visit_date'][:10]}")
                     print(f"Diagnosis: {record.get('diagnosis', 'Not provided')}")
                     print(f"Treatment: {record.get('treatment', 'Not provided')}")
@@ -725,35 +814,35 @@ class HealthcareSystem:
     
     def main_menu(self):
         """Main application menu"""
+        actions = {
+            '1': self.login_user,
+            '2': self.register_user,
+            '3': self.test_connection,
+        }
         while True:
-            print("\n" + "="*50)
-            print("🏥 PATIENT DATA MANAGEMENT SYSTEM")
-            print("="*50)
-            print("1. Login")
-            print("2. Register")
-            print("3. Test Database Connection")
-            print("4. Exit")
-            
+            print(_MAIN_MENU)
             choice = input("Select option (1-4): ").strip()
             
-            if choice == '1':
-                self.login_user()
-            elif choice == '2':
-                self.register_user()
-            elif choice == '3':
-                self.test_connection()
-            elif choice == '4':
+            if choice == '4':
                 print("Thank you for using Healthcare Portal. Goodbye!")
                 break
+            action = actions.get(choice)
+            if action:
+                action()
             else:
                 print("Invalid option! Please try again.")
     
+    def close(self):
+        """Write every queued audit entry before the process exits"""
+        if self.audit_log:
+            self.audit_log.close()
+    
     def test_connection(self):
         """Test database connection"""
         if self.supabase:
             try:
-                # Try to fetch user count
-                result = self.supabase.table("users").select("id", count="exact").execute()
+                # One row at most: proves the round-trip, and the total comes back in the count header
+                result = self.supabase.table("users").select("id", count="exact").limit(1).execute()
                 print(f"✅ Database connection successful! Total users: {result.count}")
             except Exception as e:
                 print(f"❌ Database connection test failed: {e}")
@@ -777,4 +866,6 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"\n❌ Unexpected error: {e}")
     finally:
+        # Explicit rather than left to atexit, so a logout just before quitting is never lost
+        healthcare_system.close()
         print("Goodbye!")
\ No newline at end of file
@@ -1,30 +1,68 @@
+import argparse
+import hashlib
 import os
 import psycopg2
+from psycopg2 import sql
 from dotenv import load_dotenv
 import time
 
 load_dotenv()
 
-def run_sql_file(cursor, file_path):
+SQL_FILES = [
+    'sql/supabase_schema.sql',
+    'sql/add_missing_columns.sql',
+    'sql/functions.sql',
+    'sql/create_admin.sql',
+    'sql/seed_data.sql',
+]
+# Stored as the database comment so an unchanged schema can be detected without connecting to it
+CHECKSUM_PREFIX = 'schema sha256:'
+
+def read_sql_files():
+    sql_files = {}
+    for file_path in SQL_FILES:
+        with open(file_path, 'r') as f:
+            sql_files[file_path] = f.read()
+    return sql_files
+
+def run_sql(cursor, script, file_path):
     print(f"Executing {file_path}...")
-    with open(file_path, 'r') as f:
-        sql = f.read()
-        cursor.execute(sql)
+    cursor.execute(script)
 
-def setup_db():
+def schema_checksum(sql_files):
+    h = hashlib.sha256()
+    for script in sql_files.values():
+        h.update(script.encode())
+    return CHECKSUM_PREFIX + h.hexdigest()
+
+def setup_db(force=False):
     dbname = os.getenv("LOCAL_DB_NAME", "healthcare_portal")
     user = os.getenv("LOCAL_DB_USER", "postgres")
     password = os.getenv("LOCAL_DB_PASSWORD", "postgres")
     host = os.getenv("LOCAL_DB_HOST", "localhost")
     port = os.getenv("LOCAL_DB_PORT", "5432")
 
+    # Read once: the same text is hashed and executed
+    sql_files = read_sql_files()
+    checksum = schema_checksum(sql_files)
+
     # Connect to default postgres to create the DB if it doesn't exist
     try:
         conn = psycopg2.connect(dbname='postgres', user=user, password=password, host=host, port=port)
         conn.autocommit = True
         with conn.cursor() as cursor:
-            cursor.execute(f"DROP DATABASE IF EXISTS {dbname}")
-            cursor.execute(f"CREATE DATABASE {dbname}")
+            if not force:
+                cursor.execute(
+                    "SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s",
+                    (dbname,)
+                )
+                row = cursor.fetchone()
+                if row and row[0] == checksum:
+                    conn.close()
+                    print(f"Database '{dbname}' is up to date (use --force to rebuild).")
+                    return
+            cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(dbname)))
+            cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(dbname)))
         conn.close()
         print(f"Database '{dbname}' created successfully.")
     except Exception as e:
@@ -35,10 +73,10 @@ def setup_db():
     try:
         conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
         with conn.cursor() as cursor:
-            run_sql_file(cursor, 'sql/supabase_schema.sql')
-            run_sql_file(cursor, 'sql/add_missing_columns.sql')
-            run_sql_file(cursor, 'sql/create_admin.sql')
-            run_sql_file(cursor, 'sql/seed_data.sql')
+            for file_path, script in sql_files.items():
+                run_sql(cursor, script, file_path)
+            # Recorded in the same transaction, so a failed apply never looks up to date
+            cursor.execute(sql.SQL("COMMENT ON DATABASE {} IS %s").format(sql.Identifier(dbname)), (checksum,))
         conn.commit()
         conn.close()
         print("Schema applied successfully!")
@@ -46,4 +84,6 @@ def setup_db():
         print(f"Error applying schema: {e}")
 
 if __name__ == "__main__":
-    setup_db()
+    parser = argparse.ArgumentParser(description="Create the local database and apply the SQL files")
+    parser.add_argument('--force', action='store_true', help="drop and rebuild even if the SQL files are unchanged")
+    setup_db(force=parser.parse_args().force)
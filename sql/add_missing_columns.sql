@@ -13,6 +13,10 @@ ADD COLUMN IF NOT EXISTS symptoms TEXT;
 ALTER TABLE medical_records
 ADD COLUMN IF NOT EXISTS visit_type VARCHAR(50) DEFAULT 'general';
 
+-- Per-submission key from the add-record form; a resubmitted form hits the UNIQUE constraint
+ALTER TABLE medical_records
+ADD COLUMN IF NOT EXISTS idempotency_key UUID UNIQUE;
+
 -- ============================================
 -- Fix appointments table
 -- ============================================
@@ -21,6 +25,126 @@ ADD COLUMN IF NOT EXISTS visit_type VARCHAR(50) DEFAULT 'general';
 ALTER TABLE appointments
 ADD COLUMN IF NOT EXISTS appointment_time TIME;
 
+-- Per-submission key from the booking form; a resubmitted form hits the UNIQUE constraint
+ALTER TABLE appointments
+ADD COLUMN IF NOT EXISTS idempotency_key UUID UNIQUE;
+
+-- ============================================
+-- Add vital_signs table
+-- ============================================
+
+-- Structured vitals recorded from the nurse dashboard
+CREATE TABLE IF NOT EXISTS vital_signs (
+    id BIGSERIAL PRIMARY KEY,
+    patient_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    recorded_by BIGINT REFERENCES users(id) ON DELETE SET NULL,
+    temperature NUMERIC(4,1),
+    blood_pressure VARCHAR(10),
+    pulse INTEGER,
+    respiratory_rate INTEGER,
+    oxygen_saturation INTEGER,
+    notes TEXT,
+    recorded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_vital_signs_patient ON vital_signs(patient_id, recorded_at DESC);
+
+-- ============================================
+-- Composite indexes for dashboard queries
+-- ============================================
+
+-- Every dashboard filters by patient/doctor and orders by date; the composites
+-- cover the old single-column indexes, which are dropped
+-- Covering: the nurse dashboard's newest-patients list is answered from the index alone
+CREATE INDEX IF NOT EXISTS idx_users_role_recent ON users(role, created_at DESC) INCLUDE (id, first_name, last_name, phone_number);
+-- Keyset pagination of the patients list: role = 'patient' AND id > after ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_users_role_id ON users(role, id);
+-- Doctor picker: role = 'doctor' ORDER BY last_name, served index-only
+CREATE INDEX IF NOT EXISTS idx_users_role_last_name ON users(role, last_name) INCLUDE (id, first_name);
+-- Patients list in name order: get_patients_page() keysets on these expressions
+CREATE INDEX IF NOT EXISTS idx_users_role_sort_name ON users(role, (COALESCE(last_name, '')), (COALESCE(first_name, '')), id);
+-- Patient typeahead: last_name ILIKE 'smi%'
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_users_last_name_trgm ON users USING gin (last_name gin_trgm_ops);
+-- ETag version of the appointment and record lists: newest users.updated_at, so a rename of an embedded name shows up
+CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments(patient_id, appointment_date);
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date ON appointments(doctor_id, appointment_date);
+CREATE INDEX IF NOT EXISTS idx_medical_records_patient_visit ON medical_records(patient_id, visit_date DESC);
+CREATE INDEX IF NOT EXISTS idx_medical_records_doctor_visit ON medical_records(doctor_id, visit_date DESC);
+
+DROP INDEX IF EXISTS idx_users_role;
+DROP INDEX IF EXISTS idx_users_role_created;
+DROP INDEX IF EXISTS idx_users_role_name;
+DROP INDEX IF EXISTS idx_appointments_patient;
+DROP INDEX IF EXISTS idx_appointments_doctor;
+DROP INDEX IF EXISTS idx_medical_records_patient;
+
+-- Duplicates of the indexes behind the UNIQUE constraints on username and email;
+-- login's single-row lookup by username uses users_username_key
+DROP INDEX IF EXISTS idx_users_username;
+DROP INDEX IF EXISTS idx_users_email;
+
+-- ============================================
+-- Partition audit_logs by month
+-- ============================================
+
+-- Converts an existing plain audit_logs table into the monthly-partitioned layout
+-- from supabase_schema.sql, keeping ids and the id sequence. Partitions are created
+-- for every month already holding rows; run sql/functions.sql afterwards for
+-- ensure_audit_log_partitions() and drop_old_audit_log_partitions().
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'audit_logs' AND relkind = 'r') THEN
+        ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned;
+        ALTER INDEX audit_logs_pkey RENAME TO audit_logs_unpartitioned_pkey;
+        DROP INDEX IF EXISTS idx_audit_logs_user;
+        DROP INDEX IF EXISTS idx_audit_logs_created;
+
+        CREATE TABLE audit_logs (
+            id BIGINT NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+            user_id BIGINT REFERENCES users(id) ON DELETE SET NULL,
+            action VARCHAR(100) NOT NULL,
+            table_name VARCHAR(50),
+            record_id BIGINT,
+            old_values JSONB,
+            new_values JSONB,
+            ip_address INET,
+            user_agent TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT;
+
+        FOR month_start IN
+            SELECT DISTINCT date_trunc('month', created_at)::date
+            FROM audit_logs_unpartitioned
+            WHERE created_at IS NOT NULL
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF audit_logs FOR VALUES FROM (%L) TO (%L)',
+                'audit_logs_' || to_char(month_start, 'YYYY_MM'),
+                month_start,
+                (month_start + interval '1 month')::date
+            );
+        END LOOP;
+
+        INSERT INTO audit_logs
+        SELECT id, user_id, action, table_name, record_id, old_values, new_values,
+               ip_address, user_agent, COALESCE(created_at, NOW())
+        FROM audit_logs_unpartitioned;
+
+        ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
+        DROP TABLE audit_logs_unpartitioned;
+
+        CREATE INDEX IF NOT EXISTS idx_audit_logs_user ON audit_logs(user_id);
+        CREATE INDEX IF NOT EXISTS idx_audit_logs_created ON audit_logs(created_at DESC);
+    END IF;
+END;
+$$;
+
 -- ============================================
 -- Verify the changes
 -- ============================================
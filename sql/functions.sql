@@ -0,0 +1,409 @@
+-- Database functions and views used by the Healthcare Portal
+-- Execute this script in your Supabase SQL Editor after supabase_schema.sql
+-- Safe to re-run: every object is created with CREATE OR REPLACE
+
+-- ============================================
+-- Admin dashboard
+-- ============================================
+
+-- Superseded by get_admin_counts()
+DROP VIEW IF EXISTS v_user_role_counts;
+
+-- Headline counts for /api/admin/stats in a single round-trip
+CREATE OR REPLACE FUNCTION get_admin_counts()
+RETURNS json
+LANGUAGE sql STABLE
+AS $$
+    SELECT json_build_object(
+        'patients', count(*) FILTER (WHERE role = 'patient'),
+        'doctors', count(*) FILTER (WHERE role = 'doctor'),
+        'nurses', count(*) FILTER (WHERE role = 'nurse'),
+        'administrators', count(*) FILTER (WHERE role = 'administrator'),
+        'total_users', count(*),
+        'appointments', (SELECT count(*) FROM appointments),
+        'medical_records', (SELECT count(*) FROM medical_records)
+    )
+    FROM users;
+$$;
+
+-- Returns every admin dashboard figure in a single round-trip:
+-- role counts, table counts, the 10 newest users and the 15 newest audit entries
+CREATE OR REPLACE FUNCTION get_admin_dashboard_stats()
+RETURNS json
+LANGUAGE sql STABLE
+AS $$
+    WITH role_counts AS (
+        SELECT
+            count(*) FILTER (WHERE role = 'patient') AS patients,
+            count(*) FILTER (WHERE role = 'doctor') AS doctors,
+            count(*) FILTER (WHERE role = 'nurse') AS nurses,
+            count(*) FILTER (WHERE role = 'administrator') AS administrators,
+            count(*) AS total_users
+        FROM users
+    )
+    SELECT json_build_object(
+        'patients', rc.patients,
+        'doctors', rc.doctors,
+        'nurses', rc.nurses,
+        'administrators', rc.administrators,
+        'total_users', rc.total_users,
+        'appointments', (SELECT count(*) FROM appointments),
+        'medical_records', (SELECT count(*) FROM medical_records),
+        'recent_users', COALESCE((
+            SELECT json_agg(u ORDER BY u.created_at DESC)
+            FROM (
+                SELECT id, username, role, first_name, last_name, created_at
+                FROM users
+                ORDER BY created_at DESC
+                LIMIT 10
+            ) u
+        ), '[]'::json),
+        'recent_logs', COALESCE((
+            SELECT json_agg(l ORDER BY l.created_at DESC)
+            FROM (
+                SELECT
+                    al.id,
+                    al.action,
+                    al.table_name,
+                    al.record_id,
+                    al.created_at,
+                    CASE WHEN u.id IS NULL THEN NULL
+                         ELSE json_build_object('first_name', u.first_name, 'last_name', u.last_name)
+                    END AS users
+                FROM audit_logs al
+                LEFT JOIN users u ON u.id = al.user_id
+                ORDER BY al.created_at DESC
+                LIMIT 15
+            ) l
+        ), '[]'::json)
+    )
+    FROM role_counts rc;
+$$;
+
+-- ============================================
+-- Patient dashboard
+-- ============================================
+
+-- Everything the patient dashboard renders in one round-trip:
+-- the patients row, the 5 latest medical records and the next 5 appointments,
+-- each record/appointment carrying its doctor as a nested "users" object
+CREATE OR REPLACE FUNCTION patient_dashboard(pid BIGINT)
+RETURNS json
+LANGUAGE sql STABLE
+AS $$
+    SELECT json_build_object(
+        'patient_info', (
+            SELECT json_build_object(
+                'emergency_contact', p.emergency_contact,
+                'insurance_info', p.insurance_info,
+                'blood_type', p.blood_type
+            )
+            FROM patients p
+            WHERE p.patient_id = pid
+        ),
+        'records', COALESCE((
+            SELECT json_agg(r ORDER BY r.visit_date DESC)
+            FROM (
+                SELECT
+                    mr.id, mr.visit_date, mr.diagnosis, mr.symptoms, mr.visit_type,
+                    json_build_object('first_name', u.first_name, 'last_name', u.last_name) AS users
+                FROM medical_records mr
+                JOIN users u ON u.id = mr.doctor_id
+                WHERE mr.patient_id = pid
+                ORDER BY mr.visit_date DESC
+                LIMIT 5
+            ) r
+        ), '[]'::json),
+        'appointments', COALESCE((
+            SELECT json_agg(a ORDER BY a.appointment_date)
+            FROM (
+                SELECT
+                    ap.id, ap.appointment_date, ap.appointment_time, ap.reason, ap.status,
+                    json_build_object('first_name', u.first_name, 'last_name', u.last_name) AS users
+                FROM appointments ap
+                JOIN users u ON u.id = ap.doctor_id
+                WHERE ap.patient_id = pid
+                  AND ap.appointment_date >= CURRENT_DATE
+                ORDER BY ap.appointment_date
+                LIMIT 5
+            ) a
+        ), '[]'::json)
+    );
+$$;
+
+-- ============================================
+-- Patients list (staff view)
+-- ============================================
+
+-- One page of the patients list in name order. Keyset on (last_name, first_name, id) of the
+-- previous page's last row, with missing names sorting as ''; the row comparison is served
+-- by idx_users_role_sort_name, so a deep page costs the same as the first
+CREATE OR REPLACE FUNCTION get_patients_page(
+    n INTEGER DEFAULT 20,
+    after_last VARCHAR DEFAULT NULL,
+    after_first VARCHAR DEFAULT NULL,
+    after_id BIGINT DEFAULT NULL
+)
+RETURNS TABLE (id BIGINT, first_name VARCHAR, last_name VARCHAR, email VARCHAR, phone_number VARCHAR, address TEXT, created_at TIMESTAMP WITH TIME ZONE)
+LANGUAGE sql STABLE
+AS $$
+    SELECT u.id, u.first_name, u.last_name, u.email, u.phone_number, u.address, u.created_at
+    FROM users u
+    WHERE u.role = 'patient'
+      AND (after_id IS NULL
+           OR (COALESCE(u.last_name, ''), COALESCE(u.first_name, ''), u.id)
+              > (COALESCE(after_last, ''), COALESCE(after_first, ''), after_id))
+    ORDER BY COALESCE(u.last_name, ''), COALESCE(u.first_name, ''), u.id
+    LIMIT n;
+$$;
+
+-- ============================================
+-- Patient details (staff view)
+-- ============================================
+
+-- The patient details page in one round-trip: the user (NULL unless the id is a patient),
+-- the patients row, the 5 latest records and the first 5 appointments with their
+-- doctor nested as "users", plus total counts for the "Showing 5 of N" hints
+CREATE OR REPLACE FUNCTION get_patient_page(pid BIGINT)
+RETURNS json
+LANGUAGE sql STABLE
+AS $$
+    SELECT json_build_object(
+        'patient', (
+            SELECT json_build_object(
+                'id', u.id, 'first_name', u.first_name, 'last_name', u.last_name,
+                'email', u.email, 'phone_number', u.phone_number, 'address', u.address
+            )
+            FROM users u
+            WHERE u.id = pid AND u.role = 'patient'
+        ),
+        'patient_info', (
+            SELECT json_build_object(
+                'emergency_contact', p.emergency_contact,
+                'insurance_info', p.insurance_info,
+                'blood_type', p.blood_type
+            )
+            FROM patients p
+            WHERE p.patient_id = pid
+        ),
+        'records', COALESCE((
+            SELECT json_agg(r ORDER BY r.visit_date DESC)
+            FROM (
+                SELECT
+                    mr.id, mr.visit_date, mr.diagnosis, mr.visit_type,
+                    json_build_object('first_name', u.first_name, 'last_name', u.last_name) AS users
+                FROM medical_records mr
+                JOIN users u ON u.id = mr.doctor_id
+                WHERE mr.patient_id = pid
+                ORDER BY mr.visit_date DESC
+                LIMIT 5
+            ) r
+        ), '[]'::json),
+        'record_count', (SELECT count(*) FROM medical_records WHERE patient_id = pid),
+        'appointments', COALESCE((
+            SELECT json_agg(a ORDER BY a.appointment_date)
+            FROM (
+                SELECT
+                    ap.id, ap.appointment_date, ap.appointment_time, ap.reason, ap.status,
+                    json_build_object('first_name', u.first_name, 'last_name', u.last_name) AS users
+                FROM appointments ap
+                JOIN users u ON u.id = ap.doctor_id
+                WHERE ap.patient_id = pid
+                ORDER BY ap.appointment_date
+                LIMIT 5
+            ) a
+        ), '[]'::json),
+        'appointment_count', (SELECT count(*) FROM appointments WHERE patient_id = pid)
+    );
+$$;
+
+-- ============================================
+-- Doctor dashboard
+-- ============================================
+
+-- The n patients a doctor saw most recently, one row per patient
+CREATE OR REPLACE FUNCTION doctor_recent_patients(doc_id BIGINT, n INTEGER DEFAULT 5)
+RETURNS TABLE (id BIGINT, first_name VARCHAR, last_name VARCHAR, last_visit TIMESTAMP WITH TIME ZONE)
+LANGUAGE sql STABLE
+AS $$
+    SELECT id, first_name, last_name, last_visit
+    FROM (
+        SELECT DISTINCT ON (mr.patient_id)
+            u.id, u.first_name, u.last_name, mr.visit_date AS last_visit
+        FROM medical_records mr
+        JOIN users u ON u.id = mr.patient_id
+        WHERE mr.doctor_id = doc_id
+        ORDER BY mr.patient_id, mr.visit_date DESC
+    ) latest
+    ORDER BY last_visit DESC
+    LIMIT n;
+$$;
+
+-- ============================================
+-- Audit log partitions
+-- ============================================
+
+-- Creates the monthly audit_logs partitions from the current month through `ahead` months out.
+-- Schedule monthly (e.g. pg_cron) so inserts never fall through to audit_logs_default:
+--   SELECT cron.schedule('audit-log-partitions', '0 0 1 * *',
+--       'SELECT ensure_audit_log_partitions(); SELECT drop_old_audit_log_partitions();');
+CREATE OR REPLACE FUNCTION ensure_audit_log_partitions(ahead INTEGER DEFAULT 2)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start DATE;
+BEGIN
+    FOR i IN 0..ahead LOOP
+        month_start := (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::date;
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF audit_logs FOR VALUES FROM (%L) TO (%L)',
+            'audit_logs_' || to_char(month_start, 'YYYY_MM'),
+            month_start,
+            (month_start + interval '1 month')::date
+        );
+    END LOOP;
+END;
+$$;
+
+-- Detaches monthly partitions older than keep_months and drops them, unless archive is true,
+-- in which case the detached audit_logs_YYYY_MM tables are left for pg_dump/archiving.
+-- Returns the number of partitions detached.
+CREATE OR REPLACE FUNCTION drop_old_audit_log_partitions(keep_months INTEGER DEFAULT 3, archive BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    part TEXT;
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => keep_months))::date;
+    detached INTEGER := 0;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'audit_logs'
+          AND c.relname ~ '^audit_logs_[0-9]{4}_[0-9]{2}$'
+    LOOP
+        IF to_date(substr(part, 12), 'YYYY_MM') < cutoff THEN
+            EXECUTE format('ALTER TABLE audit_logs DETACH PARTITION %I', part);
+            IF NOT archive THEN
+                EXECUTE format('DROP TABLE %I', part);
+            END IF;
+            detached := detached + 1;
+        END IF;
+    END LOOP;
+    RETURN detached;
+END;
+$$;
+
+SELECT ensure_audit_log_partitions();
+
+-- ============================================
+-- Registration
+-- ============================================
+
+-- Creates the users row, its patients / medical_staff row and, when payload has an "audit"
+-- object, the USER_REGISTERED audit_logs entry in one transaction.
+-- payload carries the users columns plus the role-specific fields; returns the new user id.
+-- Unique violations (username, email, license_number) propagate as SQLSTATE 23505.
+CREATE OR REPLACE FUNCTION register_user(payload json)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    uid BIGINT;
+    user_role TEXT := payload->>'role';
+    audit json := payload->'audit';
+BEGIN
+    INSERT INTO users (username, password, role, email, first_name, last_name, phone_number, address)
+    VALUES (
+        payload->>'username',
+        payload->>'password',
+        user_role,
+        payload->>'email',
+        payload->>'first_name',
+        payload->>'last_name',
+        payload->>'phone_number',
+        payload->>'address'
+    )
+    RETURNING id INTO uid;
+
+    IF user_role = 'patient' THEN
+        INSERT INTO patients (patient_id, emergency_contact, insurance_info, blood_type)
+        VALUES (uid, payload->>'emergency_contact', payload->>'insurance_info', payload->>'blood_type');
+    ELSIF user_role IN ('doctor', 'nurse') THEN
+        INSERT INTO medical_staff (staff_id, specialization, license_number, hire_date, department, status)
+        VALUES (uid, payload->>'specialization', payload->>'license_number', CURRENT_DATE, payload->>'department', 'active');
+    END IF;
+
+    IF audit IS NOT NULL THEN
+        INSERT INTO audit_logs (user_id, action, table_name, record_id, ip_address, user_agent, created_at)
+        VALUES (
+            uid,
+            audit->>'action',
+            audit->>'table_name',
+            uid,
+            (audit->>'ip_address')::INET,
+            audit->>'user_agent',
+            COALESCE((audit->>'created_at')::TIMESTAMPTZ, NOW())
+        );
+    END IF;
+
+    RETURN uid;
+END;
+$$;
+
+-- ============================================
+-- Medical records
+-- ============================================
+
+-- Inserts a medical record and its audit_logs entry in one transaction; returns the record id.
+-- payload carries the medical_records columns plus an "audit" object with the
+-- audit_logs columns (user_id, action, table_name, ip_address, user_agent, created_at).
+-- A repeated idempotency_key returns the existing record's id and writes nothing.
+CREATE OR REPLACE FUNCTION add_medical_record_tx(payload json)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    rid BIGINT;
+    audit json := payload->'audit';
+BEGIN
+    INSERT INTO medical_records (patient_id, doctor_id, visit_date, diagnosis, treatment, prescription, notes, visit_type, idempotency_key)
+    VALUES (
+        (payload->>'patient_id')::BIGINT,
+        (payload->>'doctor_id')::BIGINT,
+        (payload->>'visit_date')::TIMESTAMPTZ,
+        NULLIF(payload->>'diagnosis', ''),
+        NULLIF(payload->>'treatment', ''),
+        NULLIF(payload->>'prescription', ''),
+        NULLIF(payload->>'notes', ''),
+        COALESCE(NULLIF(payload->>'visit_type', ''), 'general'),
+        (payload->>'idempotency_key')::UUID
+    )
+    ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING id INTO rid;
+
+    IF rid IS NULL THEN
+        SELECT id INTO rid FROM medical_records WHERE idempotency_key = (payload->>'idempotency_key')::UUID;
+        RETURN rid;
+    END IF;
+
+    IF audit IS NOT NULL THEN
+        INSERT INTO audit_logs (user_id, action, table_name, record_id, ip_address, user_agent, created_at)
+        VALUES (
+            (audit->>'user_id')::BIGINT,
+            audit->>'action',
+            audit->>'table_name',
+            rid,
+            (audit->>'ip_address')::INET,
+            audit->>'user_agent',
+            COALESCE((audit->>'created_at')::TIMESTAMPTZ, NOW())
+        );
+    END IF;
+
+    RETURN rid;
+END;
+$$;
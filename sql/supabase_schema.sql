@@ -52,6 +52,7 @@ CREATE TABLE IF NOT EXISTS appointments (
     status VARCHAR(20) DEFAULT 'scheduled' CHECK (status IN ('scheduled', 'completed', 'cancelled', 'no_show')),
     reason TEXT,
     notes TEXT,
+    idempotency_key UUID UNIQUE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -68,13 +69,17 @@ CREATE TABLE IF NOT EXISTS medical_records (
     prescription TEXT,
     notes TEXT,
     visit_type VARCHAR(50) DEFAULT 'general',
+    idempotency_key UUID UNIQUE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
 -- Create audit_logs table for compliance and security
+-- Partitioned by month so old history can be detached/dropped instantly and the
+-- "latest entries" queries only touch the current partition.
+-- Monthly partitions are created by ensure_audit_log_partitions() (sql/functions.sql)
 CREATE TABLE IF NOT EXISTS audit_logs (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     user_id BIGINT REFERENCES users(id) ON DELETE SET NULL,
     action VARCHAR(100) NOT NULL,
     table_name VARCHAR(50),
@@ -83,19 +88,51 @@ CREATE TABLE IF NOT EXISTS audit_logs (
     new_values JSONB,
     ip_address INET,
     user_agent TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catches rows outside the monthly partitions
+CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT;
+
+-- Create vital_signs table (one row per set of vitals taken by a nurse or doctor)
+CREATE TABLE IF NOT EXISTS vital_signs (
+    id BIGSERIAL PRIMARY KEY,
+    patient_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    recorded_by BIGINT REFERENCES users(id) ON DELETE SET NULL,
+    temperature NUMERIC(4,1),
+    blood_pressure VARCHAR(10),
+    pulse INTEGER,
+    respiratory_rate INTEGER,
+    oxygen_saturation INTEGER,
+    notes TEXT,
+    recorded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
-CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
-CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
-CREATE INDEX IF NOT EXISTS idx_appointments_patient ON appointments(patient_id);
-CREATE INDEX IF NOT EXISTS idx_appointments_doctor ON appointments(doctor_id);
+-- (username and email need none: their UNIQUE constraints already build btree indexes)
+-- Composite indexes match the dashboards' "filter by owner, order by date" queries
+-- Covering: the nurse dashboard's newest-patients list is answered from the index alone
+CREATE INDEX IF NOT EXISTS idx_users_role_recent ON users(role, created_at DESC) INCLUDE (id, first_name, last_name, phone_number);
+-- Keyset pagination of the patients list: role = 'patient' AND id > after ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_users_role_id ON users(role, id);
+-- Doctor picker: role = 'doctor' ORDER BY last_name, served index-only
+CREATE INDEX IF NOT EXISTS idx_users_role_last_name ON users(role, last_name) INCLUDE (id, first_name);
+-- Patients list in name order: get_patients_page() keysets on these expressions
+CREATE INDEX IF NOT EXISTS idx_users_role_sort_name ON users(role, (COALESCE(last_name, '')), (COALESCE(first_name, '')), id);
+-- Patient typeahead: last_name ILIKE 'smi%'
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_users_last_name_trgm ON users USING gin (last_name gin_trgm_ops);
+-- ETag version of the appointment and record lists: newest users.updated_at, so a rename of an embedded name shows up
+CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments(patient_id, appointment_date);
+CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date ON appointments(doctor_id, appointment_date);
 CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments(appointment_date);
-CREATE INDEX IF NOT EXISTS idx_medical_records_patient ON medical_records(patient_id);
+CREATE INDEX IF NOT EXISTS idx_medical_records_patient_visit ON medical_records(patient_id, visit_date DESC);
+CREATE INDEX IF NOT EXISTS idx_medical_records_doctor_visit ON medical_records(doctor_id, visit_date DESC);
+CREATE INDEX IF NOT EXISTS idx_vital_signs_patient ON vital_signs(patient_id, recorded_at DESC);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_user ON audit_logs(user_id);
-CREATE INDEX IF NOT EXISTS idx_audit_logs_created ON audit_logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_created ON audit_logs(created_at DESC);
 
 -- Create function for updating timestamps
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -140,5 +177,5 @@ SELECT
     tablename 
 FROM pg_tables 
 WHERE schemaname = 'public' 
-AND tablename IN ('users', 'patients', 'medical_staff', 'appointments', 'medical_records', 'audit_logs')
+AND tablename IN ('users', 'patients', 'medical_staff', 'appointments', 'medical_records', 'vital_signs', 'audit_logs')
 ORDER BY tablename;
\ No newline at end of file
@@ -49,6 +49,32 @@ document.addEventListener('DOMContentLoaded', function() {
         }, index * 100);
     });
 
+    // Typeahead pickers: fill the input's <datalist> from the search API and
+    // keep the id of the chosen entry in the hidden field named by data-typeahead-target
+    document.querySelectorAll('[data-typeahead-url]').forEach(function(input) {
+        const list = document.getElementById(input.getAttribute('list'));
+        const hidden = document.getElementById(input.dataset.typeaheadTarget);
+        let timer;
+        input.addEventListener('input', function() {
+            const chosen = Array.from(list.options).find(option => option.value === input.value);
+            hidden.value = chosen ? chosen.dataset.id : '';
+            input.setCustomValidity(chosen || !input.value ? '' : 'Please choose an entry from the list.');
+            clearTimeout(timer);
+            if (chosen || input.value.trim().length < 2) return;
+            timer = setTimeout(async function() {
+                const data = await fetchData(input.dataset.typeaheadUrl + '&q=' + encodeURIComponent(input.value.trim()));
+                if (!data || !data.success) return;
+                list.innerHTML = '';
+                data.users.forEach(function(user) {
+                    const option = document.createElement('option');
+                    option.value = `${user.first_name} ${user.last_name} (#${user.id})`;
+                    option.dataset.id = user.id;
+                    list.appendChild(option);
+                });
+            }, 200);
+        });
+    });
+
     // Search functionality
     const searchInputs = document.querySelectorAll('input[type="search"], .search-input');
     searchInputs.forEach(function(input) {
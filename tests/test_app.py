@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import app as portal_module
+from app import HealthcareApp, Result
+
+
+class VersionQuery:
+    """Answers data_version's newest-row query with a fixed Result"""
+    def __init__(self, updated_at, count=None):
+        self.result = Result([{"updated_at": updated_at}] if updated_at else [], count)
+
+    def order(self, column, desc=False):
+        assert (column, desc) == ("updated_at", True)
+        return self
+
+    def limit(self, value):
+        return self
+
+    def execute(self):
+        return self.result
+
+
+def data_version(query, *embedded):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        return HealthcareApp.data_version(SimpleNamespace(executor=executor), query, *embedded)
+
+
+def test_data_version_changes_when_an_embedded_row_is_edited():
+    appointments = VersionQuery("2024-05-01T09:00:00+00:00", count=3)
+    before = data_version(appointments, VersionQuery("2024-04-01T08:00:00+00:00"))
+    # A patient renames themselves: only users.updated_at moves
+    after = data_version(appointments, VersionQuery("2024-05-02T10:00:00+00:00"))
+    assert before == (3, "2024-05-01T09:00:00+00:00", "2024-04-01T08:00:00+00:00")
+    assert before != after
+
+
+def test_data_version_of_an_empty_table():
+    assert data_version(VersionQuery(None, count=0)) == (0, None)
+
+
+@pytest.fixture
+def portal(monkeypatch):
+    """The web app in local mode without a database: pool is None, like after a failed connect"""
+    monkeypatch.setenv("USE_LOCAL_DB", "True")
+    monkeypatch.setattr(portal_module.DatabaseManager, "setup_local", lambda self: None)
+    portal = HealthcareApp()
+    portal.app.config["TESTING"] = True
+    monkeypatch.setattr(portal, "doctor_ids", lambda: {5})
+    return portal
+
+
+@pytest.fixture
+def doctor(portal):
+    client = portal.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 5
+        session["role"] = "doctor"
+    return client
+
+
+RECORD_FORM = {
+    "patient_id": "3",
+    "visit_date": "2024-05-01T09:30",
+    "diagnosis": "Flu",
+    "idempotency_key": "0f8fad5b-d9cb-469f-a165-70867728950e",
+}
+
+
+def test_failed_medical_record_insert_is_not_reported_as_saved(doctor):
+    # LocalRpcCall answers Result(None) when the write fails
+    response = doctor.post("/medical-records/add", data=RECORD_FORM)
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert "could not be saved" in body
+    assert "Record added!" not in body
+    # The form keeps its key, so retrying a write that did commit is still ignored
+    assert RECORD_FORM["idempotency_key"] in body
+
+
+def test_saved_medical_record_redirects_to_the_list(portal, doctor, monkeypatch):
+    calls = []
+
+    def rpc(fn_name, params=None):
+        calls.append((fn_name, params))
+        return SimpleNamespace(execute=lambda: Result(11))
+
+    monkeypatch.setattr(portal.db, "rpc", rpc)
+    response = doctor.post("/medical-records/add", data=RECORD_FORM)
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/medical-records")
+    assert calls[0][0] == "add_medical_record_tx"
+    assert calls[0][1]["payload"]["doctor_id"] == 5
+
+
+def test_patients_list_pages_in_name_order(portal, doctor, monkeypatch):
+    patients = [
+        {"id": 8, "first_name": "Ann", "last_name": "Adams", "email": None, "phone_number": None, "address": None, "created_at": None},
+        {"id": 3, "first_name": None, "last_name": "Baker", "email": None, "phone_number": None, "address": None, "created_at": None},
+        {"id": 5, "first_name": "Cy", "last_name": "Cole", "email": None, "phone_number": None, "address": None, "created_at": None},
+    ]
+    calls = []
+
+    def rpc(fn_name, params=None):
+        calls.append((fn_name, params))
+        return SimpleNamespace(execute=lambda: Result(patients))
+
+    monkeypatch.setattr(portal.db, "rpc", rpc)
+    body = doctor.get("/patients?page_size=2").get_data(as_text=True)
+    assert calls[-1] == ("get_patients_page", {"n": 3})
+    # The next page starts after Baker, whose missing first name is sent as ''
+    assert "after=3&amp;after_last=Baker&amp;after_first=&amp;page_size=2" in body
+
+    doctor.get("/patients?after=3&after_last=Baker&after_first=&page_size=2")
+    assert calls[-1] == ("get_patients_page", {"n": 3, "after_last": "Baker", "after_first": "", "after_id": 3})
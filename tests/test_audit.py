@@ -0,0 +1,99 @@
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+from audit import AuditLogWriter
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class StubDB:
+    """Records inserted audit rows; inserts containing a row with fail_action raise"""
+    def __init__(self, fail_action=None):
+        self.fail_action = fail_action
+        self.written = []
+        self._rows = None
+
+    def table(self, name):
+        assert name == "audit_logs"
+        return self
+
+    def insert(self, rows):
+        self._rows = rows
+        return self
+
+    def execute(self):
+        if any(row["action"] == self.fail_action for row in self._rows):
+            raise RuntimeError("insert failed")
+        self.written.extend(self._rows)
+
+
+def actions(db):
+    return [row["action"] for row in db.written]
+
+
+def test_close_writes_the_batch_held_by_the_writer_thread():
+    db = StubDB()
+    writer = AuditLogWriter(db, flush_interval=60)
+    writer.put({"action": "USER_LOGOUT"})
+    # Let the thread take the entry off the queue and start waiting for more
+    time.sleep(0.2)
+    writer.close()
+    assert actions(db) == ["USER_LOGOUT"]
+
+
+def test_close_writes_everything_still_queued():
+    db = StubDB()
+    writer = AuditLogWriter(db, buffer_size=2, flush_interval=60)
+    for action in ("A", "B", "C", "D", "E"):
+        writer.put({"action": action})
+    writer.close()
+    assert actions(db) == ["A", "B", "C", "D", "E"]
+
+
+def test_put_after_close_writes_inline():
+    db = StubDB()
+    writer = AuditLogWriter(db)
+    writer.close()
+    writer.put({"action": "LATE"})
+    assert actions(db) == ["LATE"]
+
+
+def test_failed_batch_is_retried_row_by_row():
+    db = StubDB(fail_action="BAD")
+    writer = AuditLogWriter(db, flush_interval=60)
+    for action in ("GOOD_1", "BAD", "GOOD_2"):
+        writer.put({"action": action})
+    writer.close()
+    assert actions(db) == ["GOOD_1", "GOOD_2"]
+
+
+def test_last_put_before_interpreter_exit_is_written():
+    # No explicit close(): the atexit handler has to drain the writer before the daemon thread dies
+    script = textwrap.dedent("""
+        import time
+        from audit import AuditLogWriter
+
+        class PrintingDB:
+            def table(self, name):
+                return self
+            def insert(self, rows):
+                self.rows = rows
+                return self
+            def execute(self):
+                for row in self.rows:
+                    print("written", row["action"], flush=True)
+
+        writer = AuditLogWriter(PrintingDB(), flush_interval=60)
+        writer.put({"action": "USER_LOGIN"})
+        writer.put({"action": "USER_LOGOUT"})
+        # Quit while the writer thread holds both entries and waits out flush_interval
+        time.sleep(0.2)
+    """)
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split("\n")[:2] == ["written USER_LOGIN", "written USER_LOGOUT"]
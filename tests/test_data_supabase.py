@@ -0,0 +1,175 @@
+import json
+import time
+
+import httpx
+import pytest
+from supabase import create_client
+
+import data_supabase
+
+
+class StubClient:
+    """Stands in for the Supabase client; records inserted audit rows"""
+    def __init__(self):
+        self.written = []
+        self._rows = None
+
+    def table(self, name):
+        assert name == "audit_logs"
+        return self
+
+    def insert(self, rows):
+        self._rows = rows
+        return self
+
+    def execute(self):
+        self.written.extend(self._rows)
+
+
+def pinned_client(handler):
+    """A real client from the pinned supabase-py whose PostgREST requests are answered by handler"""
+    client = create_client("https://example.supabase.co", "header.payload.signature")
+    postgrest = client.postgrest
+    postgrest.session = httpx.Client(
+        base_url=postgrest.session.base_url,
+        headers=postgrest.session.headers,
+        transport=httpx.MockTransport(handler),
+    )
+    return client
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """Build a HealthcareSystem on the given client"""
+    def connect(client):
+        monkeypatch.setattr(data_supabase, "get_client", lambda: client)
+        data_supabase.get_audit_log.cache_clear()
+        return data_supabase.HealthcareSystem()
+    yield connect
+    data_supabase.get_audit_log.cache_clear()
+
+
+@pytest.fixture
+def system(monkeypatch):
+    client = StubClient()
+    monkeypatch.setattr(data_supabase, "get_client", lambda: client)
+    monkeypatch.setattr(data_supabase, "AUDIT_FLUSH_INTERVAL", 60)
+    data_supabase.get_audit_log.cache_clear()
+    yield data_supabase.HealthcareSystem(), client
+    data_supabase.get_audit_log.cache_clear()
+
+
+def test_last_logged_action_is_written_on_close(system):
+    healthcare_system, client = system
+    healthcare_system.log_action(1, "USER_LOGIN", "users", 1)
+    healthcare_system.log_action(1, "PROFILE_UPDATED", "users", 1)
+    # Quit while the writer thread still holds the batch, well inside flush_interval
+    time.sleep(0.2)
+    healthcare_system.close()
+    assert [row["action"] for row in client.written] == ["USER_LOGIN", "PROFILE_UPDATED"]
+
+
+@pytest.mark.parametrize("rows, taken", [([], False), ([{"id": 4}], True)])
+def test_is_taken_fetches_at_most_one_id(connect, rows, taken):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=rows)
+
+    healthcare_system = connect(pinned_client(handler))
+    assert healthcare_system.is_taken("username", "jdoe") is taken
+    assert [str(r.url) for r in requests] == [
+        "https://example.supabase.co/rest/v1/users?select=id&username=eq.jdoe&limit=1"
+    ]
+
+
+def registration_handler(requests, taken=()):
+    """users lookups find the values in taken; register_user answers with the new id"""
+    def handler(request):
+        requests.append(request)
+        if request.url.path.endswith("/rpc/register_user"):
+            return httpx.Response(200, json=7)
+        value = next(v for k, v in request.url.params.items() if k not in ("select", "limit"))
+        return httpx.Response(200, json=[{"id": 1}] if value[3:] in taken else [])
+    return handler
+
+
+def answer_prompts(monkeypatch, answers, password="s3cretpass"):
+    answers = iter(answers)
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    monkeypatch.setattr(data_supabase.getpass, "getpass", lambda prompt="": password)
+
+
+PATIENT_ANSWERS = ["jdoe", "1", "jdoe@example.com", "Jane", "Doe", "", "", "Mom", "", "O+"]
+
+
+def test_register_user_collects_every_answer_then_writes_once(connect, monkeypatch, capsys):
+    requests = []
+    healthcare_system = connect(pinned_client(registration_handler(requests)))
+    answer_prompts(monkeypatch, PATIENT_ANSWERS)
+
+    healthcare_system.register_user()
+
+    assert [(r.method, r.url.path.rsplit("/", 1)[1]) for r in requests] == [
+        ("GET", "users"), ("GET", "users"), ("POST", "register_user")
+    ]
+    payload = json.loads(requests[-1].content)["payload"]
+    assert {k: payload[k] for k in ("username", "role", "email", "first_name", "emergency_contact", "blood_type")} == {
+        "username": "jdoe", "role": "patient", "email": "jdoe@example.com",
+        "first_name": "Jane", "emergency_contact": "Mom", "blood_type": "O+",
+    }
+    assert payload["password"].startswith("$argon2")
+    assert "Registration successful" in capsys.readouterr().out
+
+
+def test_register_user_stops_at_a_taken_email(connect, monkeypatch, capsys):
+    requests = []
+    healthcare_system = connect(pinned_client(registration_handler(requests, taken={"jdoe@example.com"})))
+    answer_prompts(monkeypatch, PATIENT_ANSWERS)
+
+    healthcare_system.register_user()
+
+    assert [r.method for r in requests] == ["GET", "GET"]
+    assert "Email already registered!" in capsys.readouterr().out
+
+
+def test_connection_test_reports_the_user_total(connect, capsys):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=[{"id": 1}], headers={"Content-Range": "0-0/42"})
+
+    healthcare_system = connect(pinned_client(handler))
+    healthcare_system.test_connection()
+
+    assert str(requests[0].url) == "https://example.supabase.co/rest/v1/users?select=id&limit=1"
+    assert requests[0].headers["Prefer"] == "count=exact"
+    assert "Database connection successful! Total users: 42" in capsys.readouterr().out
+
+
+def test_audit_log_pages_continue_within_a_shared_timestamp(connect, monkeypatch, capsys):
+    monkeypatch.setattr(data_supabase, "PAGE_SIZE", 2)
+    same_batch = "2024-05-01T09:30:00+00:00"
+    logs = [
+        {"id": 9, "action": "USER_LOGIN", "table_name": "users", "created_at": "2024-05-01T10:00:00+00:00", "users": None},
+        {"id": 8, "action": "PROFILE_UPDATED", "table_name": "users", "created_at": same_batch, "users": None},
+        {"id": 7, "action": "MEDICAL_RECORD_ADDED", "table_name": "medical_records", "created_at": same_batch, "users": None},
+    ]
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.params)
+        return httpx.Response(200, json=logs if "or" not in request.url.params else logs[2:])
+
+    healthcare_system = connect(pinned_client(handler))
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    healthcare_system.view_audit_logs()
+
+    assert [params["order"] for params in requests] == ["created_at.desc,id.desc"] * 2
+    assert requests[1]["or"] == (
+        f'(created_at.lt."{same_batch}",and(created_at.eq."{same_batch}",id.lt."8"))'
+    )
+    # The row sharing the last row's timestamp is on the second page, not skipped
+    assert "Action: MEDICAL_RECORD_ADDED" in capsys.readouterr().out
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app import LocalQueryBuilder, _execute_prepared, _split_select
+
+
+def dollar(n):
+    return f"${n}"
+
+
+def percent(n):
+    return "%s"
+
+
+class RecordingCursor:
+    """Records the statements run through it on a stand-in PreparingConnection"""
+    def __init__(self, max_prepared=100):
+        self.connection = SimpleNamespace(prepared=OrderedDict(), max_prepared=max_prepared)
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+
+def test_where_numbers_placeholders_in_filter_order():
+    builder = LocalQueryBuilder(None, "appointments").eq("doctor_id", 7).in_("status", ["scheduled"])
+    assert builder._where(dollar) == " WHERE t.doctor_id = $1 AND t.status = ANY($2)"
+    assert builder._where(percent) == " WHERE t.doctor_id = %s AND t.status = ANY(%s)"
+
+
+def test_pages_share_one_statement_with_limit_and_offset_as_parameters():
+    def page(start):
+        return LocalQueryBuilder(None, "appointments").select("*").eq("doctor_id", 7).range(start, start + 19)
+
+    first_query, first_params = page(20)._select_sql(dollar)
+    second_query, second_params = page(40)._select_sql(dollar)
+    assert first_query == second_query
+    assert first_query.endswith("WHERE t.doctor_id = $1 LIMIT $2 OFFSET $3")
+    assert first_params == [7, 20, 20]
+    assert second_params == [7, 20, 40]
+
+
+def test_prepares_once_and_reuses_the_statement():
+    cur = RecordingCursor()
+    _execute_prepared(cur, "SELECT t.* FROM users t LIMIT $1", [10])
+    _execute_prepared(cur, "SELECT t.* FROM users t LIMIT $1", [20])
+    assert [s.split()[0] for s in cur.statements] == ["PREPARE", "EXECUTE", "EXECUTE"]
+
+
+def test_least_recently_used_statement_is_deallocated_past_the_cap():
+    cur = RecordingCursor(max_prepared=2)
+    queries = [f"SELECT t.* FROM {table} t LIMIT $1" for table in ("users", "patients", "appointments")]
+    _execute_prepared(cur, queries[0], [1])
+    _execute_prepared(cur, queries[1], [1])
+    # Touch users so patients becomes the least recently used
+    _execute_prepared(cur, queries[0], [1])
+    cur.statements.clear()
+    _execute_prepared(cur, queries[2], [1])
+
+    prepared = cur.connection.prepared
+    assert len(prepared) == 2
+    deallocate = cur.statements[0]
+    assert deallocate.startswith("DEALLOCATE ")
+    assert deallocate.split()[1] not in prepared
+    assert [s.split()[0] for s in cur.statements] == ["DEALLOCATE", "PREPARE", "EXECUTE"]
+
+    # users survived the eviction; patients has to be prepared again
+    cur.statements.clear()
+    _execute_prepared(cur, queries[0], [1])
+    assert [s.split()[0] for s in cur.statements] == ["EXECUTE"]
+    cur.statements.clear()
+    _execute_prepared(cur, queries[1], [1])
+    assert [s.split()[0] for s in cur.statements] == ["DEALLOCATE", "PREPARE", "EXECUTE"]
+
+
+class RowCursor:
+    """Stands in for a psycopg2 cursor that has run the builder's SELECT"""
+    def __init__(self, names, rows):
+        self.description = [SimpleNamespace(name=name) for name in names]
+        self._rows = rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+def test_split_select_keeps_embedded_commas_together():
+    assert _split_select("id, users!doctor_id(first_name, last_name), status") == [
+        "id", "users!doctor_id(first_name, last_name)", "status"
+    ]
+    assert _split_select("*") == ["*"]
+    assert _split_select("id,") == ["id"]
+
+
+def test_fk_embeds_become_left_joins_on_the_hinted_column():
+    builder = LocalQueryBuilder(None, "appointments").select(
+        "id, patient:users!patient_id(first_name), doctor:users!doctor_id(first_name, last_name)"
+    )
+    assert builder.joins == [
+        ("patient", "LEFT JOIN users j0 ON j0.id = t.patient_id"),
+        ("doctor", "LEFT JOIN users j1 ON j1.id = t.doctor_id"),
+    ]
+    assert builder.columns == (
+        't.id, j0.first_name AS "__patient__first_name", '
+        'j1.first_name AS "__doctor__first_name", j1.last_name AS "__doctor__last_name"'
+    )
+
+
+def test_unhinted_embed_joins_back_on_the_reverse_key():
+    builder = LocalQueryBuilder(None, "users").select("id, medical_staff(specialization)")
+    assert builder.joins == [("medical_staff", "LEFT JOIN medical_staff j0 ON j0.staff_id = t.id")]
+    assert builder.columns == 't.id, j0.specialization AS "__medical_staff__specialization"'
+
+
+@pytest.mark.parametrize("columns", [
+    "id, appointments(reason)",
+    "id, users!doctor_id(*)",
+    "id, users!doctor_id(first_name, medical_staff(department))",
+])
+def test_unsupported_embeds_raise_value_error(columns):
+    with pytest.raises(ValueError, match="Unsupported embed"):
+        LocalQueryBuilder(None, "medical_records").select(columns)
+
+
+def test_rows_fold_embedded_columns_into_nested_dicts():
+    builder = LocalQueryBuilder(None, "appointments").select(
+        "id, created_at, patient:users!patient_id(first_name), doctor:users!doctor_id(first_name)"
+    )
+    cur = RowCursor(
+        ["id", "created_at", "__patient__first_name", "__doctor__first_name"],
+        [
+            (1, datetime(2024, 5, 1, 9, 30), "Ann", "Gregory"),
+            # No doctor assigned: the LEFT JOIN finds nothing and the embed comes back as None
+            (2, datetime(2024, 5, 2, 14, 0), "Bob", None),
+        ],
+    )
+    assert builder._rows(cur) == [
+        {"id": 1, "created_at": "2024-05-01T09:30:00", "patient": {"first_name": "Ann"}, "doctor": {"first_name": "Gregory"}},
+        {"id": 2, "created_at": "2024-05-02T14:00:00", "patient": {"first_name": "Bob"}, "doctor": None},
+    ]